@@ -4,9 +4,17 @@ agent.py
 Defines the main agent logic: Selects which reasoning strategy to apply for each input example
 """
 
-from strategies import self_consistency, self_refine, assumption_explicit_reasoning, chain_of_thought, get_domain, convertToPlainText
-def run_agent(prompt: str) -> str:
-    domain = get_domain(prompt) #+1 call
+from strategies import self_consistency, self_refine, assumption_explicit_reasoning, chain_of_thought, convertToPlainText
+from router import route_domain
+from budget import Budget, use_budget
+
+def run_agent(prompt: str, budget: Budget = None) -> str:
+    #every model call for this question is charged to one budget (calls, tokens, deadline), strategies shrink to fit it
+    with use_budget(budget if budget is not None else Budget.for_question()):
+        return _solve(prompt)
+
+def _solve(prompt: str) -> str:
+    domain = route_domain(prompt) #local classifier, +1 call only when it isn't confident
     #print("Domain", domain)
     # if domain not in ("Planning", "Coding", "Math", "Common Sense", "Future Prediction"):
     #     print("Domain bad")
@@ -16,15 +24,15 @@ def run_agent(prompt: str) -> str:
         result = self_consistency(prompt, False) #14 calls max
     elif domain == "Planning" or domain == "Coding":
         #result = chain_of_thought(prompt)
-        result = self_refine(prompt, domain) #10 calls max
+        result = self_refine(prompt, domain) #7 calls max
     elif domain == "Future Prediction": #future prediction
         result = assumption_explicit_reasoning(prompt, domain) #5 calls max
     else: #fallback -> self consistency
         result = self_consistency(prompt) #14 calls max
-    if result == "": #fallback for empty output, reduce chance of "" again with multiple CoT samples thru self consistency
+    if result == "": #fallback for empty output, reduce chance of "" again with multiple CoT samples thru self consistency (shrinks to the remaining budget)
         #no point in re running Self consistency with math or common sense since we originally did
         if domain == "Planning" or domain == "Coding":
-            new_res = self_consistency(prompt, num_samples=3) #3 * 2 = 6 more API calls --> 17 total, ensures majority vote with odd #
+            new_res = self_consistency(prompt, num_samples=3) #3 * 2 = 6 more API calls --> 13 total, ensures majority vote with odd #
             return new_res
         elif domain == "Future Prediction":
             new_res = self_consistency(prompt, num_samples=5) #5 * 2 = 10 more API calls --> 16 total 
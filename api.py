@@ -1,20 +1,99 @@
-import os, json, textwrap, re, time
+import os, json, textwrap, re, time, threading, asyncio
+from contextlib import contextmanager
 import requests
+from requests.adapters import HTTPAdapter
+from cache import get_cache, make_key
+from tracing import record_call
+from scheduler import get_scheduler
+from budget import current_budget
 
 API_KEY  = os.getenv("OPENAI_API_KEY", "cse476")
 API_BASE = os.getenv("API_BASE", "http://10.4.58.53:41701/v1")  
 MODEL    = os.getenv("MODEL_NAME", "bens_model")              
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT_REQUESTS", "8")) #global cap on concurrent requests across all questions + strategies
+STREAMING = os.getenv("STREAM_RESPONSES", "1") != "0" #set to 0 if the server doesn't support SSE streaming
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(MAX_INFLIGHT))) #keep-alive connections kept open to API_BASE
+BATCH_SAMPLES = os.getenv("BATCH_SAMPLES", "0") == "1" #server supports n > 1 (several completions of one prompt per request)
+
+_inflight = threading.BoundedSemaphore(MAX_INFLIGHT)
+_session = None
+_session_lock = threading.Lock()
+_count_lock = threading.Lock()
+_request_count = 0
+
+def get_request_count() -> int:
+    """Total number of model requests sent by this process."""
+    return _request_count
+
+def get_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """
+    Returns the process-wide pooled Session (created on first use). Connections are
+    kept alive between calls so each request skips the TCP/TLS handshake.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                _session = session
+    return _session
 
 def call_model_chat_completions(prompt: str,
                                 system: str = "You are a helpful assistant. Reply with only the final answer—no explanation.",
                                 model: str = MODEL,
                                 temperature: float = 0.0,
                                 max_tokens: int = 512,
-                                timeout: int = 60) -> dict:
+                                timeout: int = 60,
+                                use_cache: bool = True,
+                                step: str = None,
+                                stop_when=None,
+                                history: list = None,
+                                n: int = 1,
+                                cancel: threading.Event = None) -> dict:
     """
     Calls an OpenAI-style /v1/chat/completions endpoint and returns:
     { 'ok': bool, 'text': str or None, 'raw': dict or None, 'status': int, 'error': str or None, 'headers': dict }
+    Successful deterministic (temperature 0) calls are served from / stored in the response cache (cache.py).
+    Every call is recorded in tracing.py under the given step name (route, convert, cot, ...).
+    Timeouts, 429s and 5xx responses are retried with backoff by the request scheduler (scheduler.py).
+    Network calls are charged to the active question budget (budget.py); once it is spent the call
+    returns ok=False with status -2 without sending anything.
+    If stop_when is given, the response is streamed (SSE) and generation is aborted as soon as
+    stop_when(text_so_far) returns True at a line boundary; the result then also carries
+    'ttft_ms' (time to first token), 'stopped_early' and 'stopped_reason' ("predicate", or "deadline"
+    when the question deadline cut the stream; such truncated results are never cached).
+    history is a list of earlier {'role', 'content'} turns sent between the system prompt and prompt,
+    for multi-turn conversations whose shared prefix the server can cache.
+    n > 1 asks for n completions of the same messages in one request (servers with BATCH_SAMPLES support);
+    the result then also carries 'texts', one per choice. Such calls are neither cached nor streamed.
+    cancel is an Event the caller sets once it no longer needs the result: a call not yet sent fails
+    with status -2 and a stream in progress is closed, both with stopped_reason "cancelled" (never cached).
     """
+    start = time.perf_counter()
+    cache = get_cache() if use_cache else None
+    cache_key = None
+    if cache is not None and n == 1 and cache.should_cache(temperature):
+        cache_key = make_key(model, system, prompt, temperature, max_tokens, history)
+        hit = cache.get(cache_key)
+        if hit is not None:
+            result = {"ok": True, "text": hit["text"], "raw": hit["raw"], "status": 200, "error": None, "headers": {}, "cached": True}
+            record_call(step, model, (time.perf_counter() - start) * 1000, 0.0, result)
+            return result
+
+    budget = current_budget()
+    if cancel is not None and cancel.is_set():
+        result = _cancelled()
+        record_call(step, model, (time.perf_counter() - start) * 1000, 0.0, result)
+        return result
+    if budget.exhausted(): #out of calls/tokens/time for this question, strategies keep their best answer
+        result = _budget_exhausted()
+        record_call(step, model, (time.perf_counter() - start) * 1000, 0.0, result)
+        return result
+
     url = f"{API_BASE}/chat/completions"
     headers = {
         "Authorization": f"Bearer {API_KEY}",
@@ -24,20 +103,80 @@ def call_model_chat_completions(prompt: str,
         "model": model,
         "messages": [
             {"role": "system", "content": system},
+            *(history or []),
             {"role": "user",   "content": prompt}
         ],
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
+    if n > 1:
+        payload["n"] = n
 
+    streaming = stop_when is not None and STREAMING and n == 1
+    if streaming:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+
+    def send() -> tuple: #every attempt, retries included, is charged to the budget
+        if budget.exhausted():
+            return _budget_exhausted(), 0.0
+        if cancel is not None and cancel.is_set(): #e.g. the vote was decided while this one was queued
+            return _cancelled(), 0.0
+        budget.charge(calls=1)
+        if streaming:
+            return _post_stream(url, headers, payload, timeout, stop_when, budget.deadline_at, cancel)
+        return _post(url, headers, payload, timeout, budget.deadline_at)
+
+    result, queue_ms, retries = get_scheduler().run(send, deadline=budget.deadline_at) #retries, backoff, rate limits
+    usage = (result.get("raw") or {}).get("usage") or {}
+    budget.charge(tokens=usage.get("total_tokens") or (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0))
+    if result["ok"] and cache_key is not None and result.get("stopped_reason") in (None, "predicate"): #deadline/cancelled = truncated
+        cache.put(cache_key, {"text": result["text"], "raw": result["raw"]})
+    record_call(step, model, (time.perf_counter() - start) * 1000, queue_ms, result, retries=retries)
+    return result
+
+def _budget_exhausted(error: str = "question budget exhausted") -> dict:
+    return {"ok": False, "text": None, "raw": None, "status": -2, "error": error, "headers": {}}
+
+def _cancelled() -> dict:
+    return {**_budget_exhausted("request cancelled by the caller"), "stopped_reason": "cancelled"}
+
+@contextmanager
+def _inflight_slot(deadline: float):
+    """
+    Holds one of the MAX_INFLIGHT request slots, waiting at most until deadline (time.monotonic()).
+    Yields False if no slot freed up in time; otherwise counts the request and yields True.
+    """
+    global _request_count
+    remaining = deadline - time.monotonic()
+    acquired = _inflight.acquire(timeout=None if remaining == float("inf") else max(0.0, remaining))
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=timeout)
+        if acquired:
+            with _count_lock:
+                _request_count += 1
+        yield acquired
+    finally:
+        if acquired:
+            _inflight.release()
+
+def _capped(timeout: float, deadline: float) -> float:
+    """Request timeout capped to the time left once a slot is held."""
+    return max(1, min(timeout, deadline - time.monotonic()))
+
+def _post(url: str, headers: dict, payload: dict, timeout: int, deadline: float = float("inf")) -> tuple:
+    """Sends one request through the pooled session; returns (result dict, ms spent waiting for an in-flight slot)."""
+    queued = time.perf_counter()
+    queue_ms = 0.0
+    try:
+        with _inflight_slot(deadline) as acquired: #blocks while MAX_INFLIGHT requests are already out
+            queue_ms = (time.perf_counter() - queued) * 1000
+            if not acquired:
+                return _budget_exhausted("deadline reached waiting for an in-flight slot"), queue_ms
+            resp = get_session().post(url, headers=headers, json=payload, timeout=_capped(timeout, deadline))
         status = resp.status_code
         hdrs   = dict(resp.headers)
         if status == 200:
-            data = resp.json()
-            text = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            return {"ok": True, "text": text, "raw": data, "status": status, "error": None, "headers": hdrs}
+            return _json_result(resp.json(), status, hdrs), queue_ms
         else:
             # try best-effort to surface error text
             err_text = None
@@ -45,6 +184,89 @@ def call_model_chat_completions(prompt: str,
                 err_text = resp.json()
             except Exception:
                 err_text = resp.text
-            return {"ok": False, "text": None, "raw": None, "status": status, "error": str(err_text), "headers": hdrs}
+            return {"ok": False, "text": None, "raw": None, "status": status, "error": str(err_text), "headers": hdrs}, queue_ms
     except requests.RequestException as e:
-        return {"ok": False, "text": None, "raw": None, "status": -1, "error": str(e), "headers": {}}
+        return {"ok": False, "text": None, "raw": None, "status": -1, "error": str(e), "headers": {}}, queue_ms
+
+def _json_result(data: dict, status: int, hdrs: dict) -> dict:
+    texts = [(choice.get("message") or {}).get("content", "") for choice in data.get("choices") or [{}]]
+    return {"ok": True, "text": texts[0], "texts": texts, "raw": data, "status": status, "error": None, "headers": hdrs}
+
+def _estimated_usage(payload: dict, text: str) -> dict:
+    """Rough usage (~4 chars per token) for a stream closed before the server sent its usage chunk."""
+    prompt_chars = sum(len(m.get("content") or "") for m in payload.get("messages") or [])
+    prompt_tokens, completion_tokens = prompt_chars // 4 + 1, len(text) // 4 + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens, "estimated": True}
+
+def _post_stream(url: str, headers: dict, payload: dict, timeout: int, stop_when, deadline: float,
+                 cancel: threading.Event = None) -> tuple:
+    """
+    Streaming variant of _post. Reads SSE chunks, checks stop_when whenever a line completes and
+    closes the connection once it fires (or the question deadline passes, or cancel is set), which
+    aborts generation.
+    """
+    queued = time.perf_counter()
+    queue_ms = 0.0
+    try:
+        with _inflight_slot(deadline) as acquired: #blocks while MAX_INFLIGHT requests are already out
+            queue_ms = (time.perf_counter() - queued) * 1000
+            if not acquired:
+                return _budget_exhausted("deadline reached waiting for an in-flight slot"), queue_ms
+            sent = time.perf_counter()
+            resp = get_session().post(url, headers=headers, json=payload, timeout=_capped(timeout, deadline), stream=True)
+            try:
+                status = resp.status_code
+                hdrs   = dict(resp.headers)
+                if status != 200:
+                    err_text = None
+                    try:
+                        err_text = resp.json()
+                    except Exception:
+                        err_text = resp.text
+                    return {"ok": False, "text": None, "raw": None, "status": status, "error": str(err_text), "headers": hdrs}, queue_ms
+                if not resp.headers.get("Content-Type", "").startswith("text/event-stream"): #server ignored stream=true
+                    return _json_result(resp.json(), status, hdrs), queue_ms
+                parts, usage, ttft_ms, stopped = [], None, None, None
+                for raw_line in resp.iter_lines(): #bytes; requests would decode SSE as ISO-8859-1
+                    line = raw_line.decode("utf-8")
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or usage
+                    choices = chunk.get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if not delta:
+                        continue
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - sent) * 1000
+                    parts.append(delta)
+                    if "\n" in delta and stop_when("".join(parts)): #only check once a line is complete
+                        stopped = "predicate"
+                        break
+                    if time.monotonic() >= deadline: #out of time, keep what we have (but never cache it)
+                        stopped = "deadline"
+                        break
+                    if cancel is not None and cancel.is_set(): #caller no longer needs this result
+                        stopped = "cancelled"
+                        break
+            finally:
+                resp.close() #dropping the connection aborts generation server-side
+        text = "".join(parts)
+        if stopped and "\n" in text:
+            text = text[:text.rfind("\n") + 1] #drop the partial line that arrived with the stopping chunk
+        raw = {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": usage or _estimated_usage(payload, text)}
+        return {"ok": True, "text": text, "raw": raw, "status": status, "error": None, "headers": hdrs,
+                "ttft_ms": ttft_ms, "stopped_early": stopped is not None, "stopped_reason": stopped}, queue_ms
+    except (requests.RequestException, ValueError) as e: #ValueError: malformed SSE chunk or body, bad UTF-8
+        return {"ok": False, "text": None, "raw": None, "status": -1, "error": str(e), "headers": {}}, queue_ms
+
+async def async_call_model_chat_completions(prompt: str, **kwargs) -> dict:
+    """
+    Event-loop friendly variant of call_model_chat_completions. Runs the pooled client in a
+    worker thread so it shares the same connection pool and in-flight cap.
+    """
+    return await asyncio.to_thread(call_model_chat_completions, prompt, **kwargs)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for extract.extract_final_answer over a corpus of recorded model outputs.
+
+The corpus is a JSONL file with one {"text": ...} object or JSON string per line. By default it is
+the chain-of-thought traces written by the last generate_answer_template.py run (COT_TRACE_PATH),
+i.e. the sampled reasoning the extractor actually sees. Reports per-pattern hit rates, how often the model fallback in strategies.extract_answer would fire, and the time per
+trace compared to the previous uncompiled multi-pass extractor.
+
+Usage:
+    python bench_extract.py [--corpus outputs.jsonl] [--math] [--repeat 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from typing import Callable, List
+
+from extract import PATTERNS, extract_final_answer, extraction_stats, reset_extraction_stats
+from generate_answer_template import COT_TRACE_PATH
+
+
+def legacy_extract_final_answer(ans: str, isMath: bool = False) -> str:
+    """The extractor strategies.py used before extract.py, kept here as the baseline."""
+    if not ans:
+        return ""
+    ans = ans.strip()
+    match = re.search(r'(?:final\s+answer\s*:?\s*)(.*)', ans, re.IGNORECASE | re.DOTALL)
+    if match:
+        answer = match.group(1).strip()
+        answer = answer.strip('"\'')
+        if answer:
+            return answer
+    mc_patterns = [
+        r'(?:answer is|correct answer is|therefore|thus|option|answer choice)\s*:?\s*([A-E])\b',
+        r'\b([A-E])\s+is\s+(?:the\s+)?correct',
+        r'(?:choose|select)\s+(?:option\s+)?([A-E])\b'
+    ]
+    for pattern in mc_patterns:
+        match = re.search(pattern, ans, re.IGNORECASE)
+        if match:
+            return match.group(1).upper()
+    match = re.search(r'\b([A-E])\s*[.)]?\s*$', ans, re.IGNORECASE)
+    if match:
+        return match.group(1).upper()
+    if re.search(r'\d', ans):
+        numbers = re.findall(r'-?\d+\.?\d*', ans)
+        if numbers:
+            if isMath:
+                return numbers[-1]
+    return ans
+
+
+def load_corpus(path: Path) -> List[str]:
+    if not path.exists():
+        raise SystemExit(
+            f"No corpus at {path}. Run generate_answer_template.py first to record CoT traces "
+            "(written to COT_TRACE_PATH), or pass --corpus <file.jsonl>."
+        )
+    texts = []
+    with path.open("r", encoding="utf-8") as fp:
+        for line in fp:
+            if line.strip():
+                record = json.loads(line)
+                texts.append(record["text"] if isinstance(record, dict) else str(record))
+    return texts
+
+
+def needs_fallback(trace: str, answer: str) -> bool:
+    return bool(trace) and (len(answer) > 500 or answer == trace.strip())
+
+
+def time_extractor(extract: Callable, corpus: List[str], is_math: bool, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for trace in corpus:
+            extract(trace, isMath=is_math)
+    return (time.perf_counter() - start) / max(len(corpus) * repeat, 1) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=COT_TRACE_PATH)
+    parser.add_argument("--math", action="store_true", help="extract as math (enables trailing-number fallback)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print("Corpus is empty.")
+        return
+
+    reset_extraction_stats()
+    new_fallbacks = sum(needs_fallback(t, extract_final_answer(t, isMath=args.math)) for t in corpus)
+    old_fallbacks = sum(needs_fallback(t, legacy_extract_final_answer(t, isMath=args.math)) for t in corpus)
+    stats = extraction_stats()
+
+    print(f"Corpus: {len(corpus)} traces, mean {sum(map(len, corpus)) / len(corpus):.0f} chars")
+    print("Pattern hit rates:")
+    for kind in PATTERNS + ("miss",):
+        print(f"  {kind:<8} {stats[kind]['hits']:>6}  {stats[kind]['rate']:.1%}")
+    print(
+        f"Model fallback rate: {new_fallbacks / len(corpus):.1%} "
+        f"(legacy extractor: {old_fallbacks / len(corpus):.1%})"
+    )
+    new_us = time_extractor(extract_final_answer, corpus, args.math, args.repeat)
+    old_us = time_extractor(legacy_extract_final_answer, corpus, args.math, args.repeat)
+    print(f"Time per trace: {new_us:.1f} us (legacy extractor: {old_us:.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
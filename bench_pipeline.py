@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the full answering pipeline (generate_answer_template.build_answers) against
+the deterministic mock model server (mock_server.py), at several concurrency levels.
+
+For each level it reports questions/sec, model calls per question by domain, cancelled calls, the
+mean samples_used of self-consistency questions, and p50/p95 latency per model call and per
+question. The mock and the strategies' sampling temperatures are seeded (--seed), so at
+--concurrency 1 two runs of the same tree make the same calls. At higher levels, thread scheduling
+still decides which question draws which temperature and which samples finish first, so call
+counts can vary slightly between runs.
+
+Usage:
+    python bench_pipeline.py [--input cse_476_final_project_test_data.json] [--limit 50]
+                             [--concurrency 1,4,16] [--latency-ms 400] [--error-rate 0.02]
+                             [--replay] [--output bench.json]
+
+Without --input (or if the file is missing) a small built-in set of questions covering every
+domain is used. The response cache is disabled so every call reaches the mock.
+"""
+
+from __future__ import annotations
+
+import os
+
+os.environ.setdefault("RESPONSE_CACHE", "0")  # measure the calls, not the cache
+os.environ.setdefault("SERVER_RPS", "0")  # the mock has no capacity limit to pace against
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+import api
+import generate_answer_template as pipeline
+from cache import CACHE_PATH, ResponseCache
+from mock_server import MockConfig, start_server
+from router import classify_domain
+from strategies import clear_conversion_cache
+from tracing import get_question_records, get_records, percentile, reset_records
+
+SAMPLE_QUESTIONS = [
+    {"input": "What is 17 * 23 + 4?", "domain": "math"},
+    {"input": "Solve for $x$: $\\frac{x}{3} + 2 = 7$.", "domain": "math"},
+    {"input": "If a train travels 60 miles per hour for 2.5 hours, how far does it travel?", "domain": "math"},
+    {"input": "Where would you most likely keep milk to stop it from spoiling? (A) pantry (B) refrigerator "
+              "(C) oven (D) garage", "domain": "common_sense"},
+    {"input": "Why do people usually carry an umbrella when the sky is dark and cloudy?", "domain": "common_sense"},
+    {"input": "Will the average global temperature in 2030 be higher than in 2020?", "domain": "future_prediction"},
+    {"input": "Predict which team is more likely to win next season's championship and explain why.",
+     "domain": "future_prediction"},
+    {"input": "Write a Python function that returns the nth Fibonacci number.", "domain": "coding"},
+    {"input": "Fix the bug in this code: def add(a, b): return a - b", "domain": "coding"},
+    {"input": "Plan a sequence of actions to stack block A on block B, given that block C is on block A.",
+     "domain": "planning"},
+]
+
+
+def load_benchmark_questions(path: Path, limit: int) -> List[Dict[str, Any]]:
+    questions = pipeline.load_questions(path) if path and path.exists() else SAMPLE_QUESTIONS
+    return questions[:limit] if limit else questions
+
+
+def run_level(questions: List[Dict[str, Any]], level: int, seed: int = 0) -> Dict[str, Any]:
+    reset_records()
+    clear_conversion_cache()  # every level starts cold
+    random.seed(seed)  # self_consistency's sampling temperatures
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        pipeline.build_answers(questions, num_workers=level, checkpoint_path=Path(tmp) / "bench.jsonl", resume=False)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+
+    records = get_records()
+    domains = {idx: classify_domain(q["input"])[0] for idx, q in enumerate(questions)}
+    calls_per_question = Counter(r["question_id"] for r in records)
+    by_domain = defaultdict(list)
+    for idx, domain in domains.items():
+        by_domain[domain].append(calls_per_question[idx])
+    call_ms = [r["wall_ms"] for r in records]
+    question_records = get_question_records()
+    question_ms = [r["wall_ms"] for r in question_records]
+    samples = [r["samples_used"] for r in question_records if "samples_used" in r]
+    return {
+        "concurrency": level,
+        "questions": len(questions),
+        "seconds": round(elapsed, 3),
+        "questions_per_sec": round(len(questions) / elapsed, 3),
+        "calls": len(records),
+        "errors": sum(not r["ok"] and r["stopped_reason"] != "cancelled" for r in records),
+        "cancelled": sum(r["stopped_reason"] == "cancelled" for r in records),
+        "retries": sum(r["retries"] for r in records),
+        "calls_per_question": {d: round(sum(c) / len(c), 2) for d, c in sorted(by_domain.items())},
+        "samples_per_sc_question": round(sum(samples) / len(samples), 2) if samples else 0.0,
+        "call_ms_p50": round(percentile(call_ms, 50), 1),
+        "call_ms_p95": round(percentile(call_ms, 95), 1),
+        "question_ms_p50": round(percentile(question_ms, 50), 1),
+        "question_ms_p95": round(percentile(question_ms, 95), 1),
+    }
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    print(f"\n{'workers':>7}{'q/s':>8}{'calls':>7}{'errors':>7}{'retries':>8}{'cancelled':>10}{'samples':>9}"
+          f"{'call p95 ms':>13}{'question p95 ms':>17}")
+    for row in results:
+        print(f"{row['concurrency']:>7}{row['questions_per_sec']:>8.2f}{row['calls']:>7}{row['errors']:>7}"
+              f"{row['retries']:>8}{row['cancelled']:>10}{row['samples_per_sc_question']:>9.2f}"
+              f"{row['call_ms_p95']:>13.0f}{row['question_ms_p95']:>17.0f}")
+    print("\nCalls per question by domain")
+    for row in results:
+        per_domain = ", ".join(f"{d}: {n}" for d, n in row["calls_per_question"].items())
+        print(f"  workers={row['concurrency']}: {per_domain}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", type=Path, default=pipeline.INPUT_PATH)
+    parser.add_argument("--limit", type=int, default=0, help="only the first N questions (0 = all)")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated NUM_WORKERS levels")
+    parser.add_argument("--latency-ms", type=float, default=400.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", action="store_true", help="serve recorded responses from the response cache first")
+    parser.add_argument("--output", type=Path, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+        replay=ResponseCache(CACHE_PATH) if args.replay else None,
+    )
+    server = start_server(config)
+    api.API_BASE = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    questions = load_benchmark_questions(args.input, args.limit)
+    print(f"Benchmarking {len(questions)} questions against mock server at {api.API_BASE}")
+    results = []
+    for level in (int(level) for level in args.concurrency.split(",") if level.strip()):
+        config.attempts.clear()  # every level sees the same error sequence
+        results.append(run_level(questions, level, args.seed))
+    server.shutdown()
+
+    print_results(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark the local domain router (router.py): routing accuracy against the dataset's "domain"
+labels, per-prompt latency, and how often the LLM fallback would fire.
+
+Usage:
+    python bench_router.py [--input cse_476_final_project_test_data.json] [--llm N]
+
+--llm N also runs the LLM router (strategies.get_domain) on the first N prompts and reports how
+often the two routers agree and how long the LLM call takes.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+from router import DOMAINS, MIN_CONFIDENCE, match_domain, classify_domain
+from strategies import get_domain
+from tracing import percentile
+
+INPUT_PATH = Path("cse_476_final_project_test_data.json")
+
+
+def normalize_label(label: str) -> str:
+    """Map dataset labels such as "common_sense" or "math" onto router domain names."""
+    return match_domain(str(label).replace("_", " "))
+
+
+def bench_local(questions: List[Dict], min_confidence: float) -> None:
+    latencies = []
+    correct = labelled = fallbacks = 0
+    confusion: Counter = Counter()
+    for question in questions:
+        start = time.perf_counter()
+        domain, confidence = classify_domain(question["input"])
+        latencies.append((time.perf_counter() - start) * 1e6)
+        if confidence < min_confidence:
+            fallbacks += 1
+        label = normalize_label(question.get("domain", ""))
+        if label:
+            labelled += 1
+            correct += domain == label
+            confusion[(label, domain)] += 1
+
+    print(f"Local router on {len(questions)} prompts")
+    print(
+        f"  latency (us): mean {sum(latencies) / max(len(latencies), 1):.1f}, "
+        f"p50 {percentile(latencies, 50):.1f}, p99 {percentile(latencies, 99):.1f}"
+    )
+    print(
+        f"  LLM fallback rate at confidence < {min_confidence}: "
+        f"{fallbacks / max(len(questions), 1):.1%} ({fallbacks} prompts)"
+    )
+    if not labelled:
+        print("  no 'domain' labels in input, accuracy not reported")
+        return
+    print(f"  accuracy: {correct / labelled:.1%} ({correct}/{labelled})")
+    for label in DOMAINS:
+        row = {pred: confusion[(label, pred)] for pred in DOMAINS if confusion[(label, pred)]}
+        if row:
+            print(f"    {label:<18} -> {row}")
+
+
+def bench_llm(questions: List[Dict], limit: int) -> None:
+    sample = questions[:limit]
+    latencies = []
+    agree = 0
+    for question in sample:
+        start = time.perf_counter()
+        llm_domain = match_domain(get_domain(question["input"]))
+        latencies.append((time.perf_counter() - start) * 1e3)
+        agree += llm_domain == classify_domain(question["input"])[0]
+    print(f"LLM router on {len(sample)} prompts")
+    print(
+        f"  latency (ms): mean {sum(latencies) / max(len(latencies), 1):.1f}, "
+        f"p50 {percentile(latencies, 50):.1f}, p99 {percentile(latencies, 99):.1f}"
+    )
+    print(f"  agreement with local router: {agree / max(len(sample), 1):.1%}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", type=Path, default=INPUT_PATH)
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE)
+    parser.add_argument("--llm", type=int, default=0, metavar="N")
+    args = parser.parse_args()
+
+    if not args.input.exists():
+        raise SystemExit(f"No test data at {args.input}; pass the labelled question file with --input.")
+    with args.input.open("r") as fp:
+        questions = json.load(fp)
+    bench_local(questions, args.min_confidence)
+    if args.llm:
+        bench_llm(questions, args.llm)
+
+
+if __name__ == "__main__":
+    main()
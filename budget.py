@@ -0,0 +1,69 @@
+"""
+budget.py
+
+Per-question budget (max model calls, max tokens, wall-clock deadline). run_agent activates one
+budget per question; call_model_chat_completions charges it and refuses new requests once it is
+spent, and the strategies consult it to shrink their plans so that the best answer found so far is
+returned by the deadline.
+
+The active budget lives in a contextvar, so work submitted with tracing.submit_in_context shares it.
+"""
+import contextvars, os, threading, time
+from contextlib import contextmanager
+
+QUESTION_MAX_CALLS  = int(os.getenv("QUESTION_MAX_CALLS", "24"))
+QUESTION_MAX_TOKENS = int(os.getenv("QUESTION_MAX_TOKENS", "80000"))
+QUESTION_DEADLINE   = float(os.getenv("QUESTION_DEADLINE", "300")) #seconds
+
+INF = float("inf")
+
+
+class Budget:
+    def __init__(self, max_calls: int = None, max_tokens: int = None, deadline: float = None):
+        """None means unlimited; deadline is in seconds from now."""
+        self.max_calls = INF if max_calls is None else max_calls
+        self.max_tokens = INF if max_tokens is None else max_tokens
+        self.deadline_at = INF if deadline is None else time.monotonic() + deadline
+        self.calls = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_question(cls) -> "Budget":
+        return cls(QUESTION_MAX_CALLS, QUESTION_MAX_TOKENS, QUESTION_DEADLINE)
+
+    def charge(self, calls: int = 0, tokens: int = 0) -> None:
+        with self._lock:
+            self.calls += calls
+            self.tokens += tokens
+
+    def remaining_calls(self) -> float:
+        return self.max_calls - self.calls
+
+    def remaining_tokens(self) -> float:
+        return self.max_tokens - self.tokens
+
+    def remaining_time(self) -> float:
+        return self.deadline_at - time.monotonic()
+
+    def can_afford(self, calls: int = 1) -> bool:
+        return self.remaining_calls() >= calls and self.remaining_tokens() > 0 and self.remaining_time() > 0
+
+    def exhausted(self) -> bool:
+        return not self.can_afford(1)
+
+
+_UNLIMITED = Budget()
+_current = contextvars.ContextVar("budget", default=_UNLIMITED)
+
+def current_budget() -> Budget:
+    """The active budget, or an unlimited one outside run_agent."""
+    return _current.get()
+
+@contextmanager
+def use_budget(budget: Budget):
+    token = _current.set(budget)
+    try:
+        yield budget
+    finally:
+        _current.reset(token)
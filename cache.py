@@ -0,0 +1,117 @@
+"""
+cache.py
+
+Persistent, content-addressed cache for model responses. Entries are keyed by a hash of
+(model, system, prompt, temperature, max_tokens, earlier conversation turns) and stored in SQLite, with an in-memory LRU
+in front of it so repeated lookups within a run never touch disk.
+"""
+import os, json, hashlib, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Optional
+
+CACHE_ENABLED  = os.getenv("RESPONSE_CACHE", "1") != "0"
+CACHE_PATH     = os.getenv("RESPONSE_CACHE_PATH", ".cache/responses.sqlite")
+CACHE_SAMPLED  = os.getenv("RESPONSE_CACHE_SAMPLED", "0") == "1" #also cache temperature > 0 calls
+MAX_ENTRIES    = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "100000"))
+MAX_AGE        = float(os.getenv("RESPONSE_CACHE_MAX_AGE", str(30 * 24 * 3600))) #seconds
+MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "2048"))
+
+def make_key(model: str, system: str, prompt: str, temperature: float, max_tokens: int, history: list = None) -> str:
+    parts = [model, system, prompt, float(temperature), int(max_tokens)]
+    if history: #multi-turn calls; single-turn keys are unchanged
+        parts.append(history)
+    blob = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES, max_age: float = MAX_AGE,
+                 memory_entries: int = MEMORY_ENTRIES, cache_sampled: bool = CACHE_SAMPLED):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.memory_entries = memory_entries
+        self.cache_sampled = cache_sampled
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._writes = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def should_cache(self, temperature: float) -> bool:
+        return self.cache_sampled or temperature <= 0
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                created, value = self._memory[key]
+                if now - created <= self.max_age:
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = json.loads(row[0]), row[1]
+            if now - created > self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, created, value)
+            return value
+
+    def put(self, key: str, value: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._conn.commit()
+            self._remember(key, now, value)
+            self._writes += 1
+            if self._writes % 1000 == 0: #amortize eviction
+                self._evict_locked()
+
+    def evict(self) -> None:
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key NOT IN "
+            "(SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        self._conn.commit()
+
+    def _remember(self, key: str, created: float, value: dict) -> None:
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> Optional[ResponseCache]:
+    """Returns the process-wide cache, or None when RESPONSE_CACHE=0."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
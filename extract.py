@@ -0,0 +1,160 @@
+"""
+extract.py
+
+Deterministic final-answer extraction from reasoning traces. All patterns are compiled once and the
+trace is searched from the end (rfind for literal markers, regexes over the tail before the whole
+text), so the last occurrence of each marker wins. Markers are preferred in this order:
+"Final Answer:" > \\boxed{...} > "Answer:" line > multiple-choice phrasing > trailing letter > trailing number (math only).
+
+Per-pattern hit counts are kept so we can see how often extraction falls through to the model.
+"""
+import re, threading
+from collections import Counter
+
+PATTERNS = ("final", "boxed", "answer", "mc", "letter", "number")
+TAIL = 1500 #answers almost always sit at the end of the trace; look there before scanning it all
+
+_FINAL_SUFFIX = re.compile(r"(?:\s+is)?\s*(?::|-(?=\s))?[\s*]*", re.IGNORECASE) #"-" only as a separator, never a minus sign
+_ANSWER_LINE = re.compile(r"(?:^|\n)[ \t>#*]*answer\**\s*:\**[ \t]*", re.IGNORECASE)
+_MC = re.compile(
+    r"(?:answer is|correct answer is|therefore|thus|option|answer choice)\s*:?\s*\(?([A-E])\b"
+    r"|\b([A-E])\s+is\s+(?:the\s+)?correct"
+    r"|(?:choose|select)\s+(?:option\s+)?\(?([A-E])\b",
+    re.IGNORECASE,
+)
+_TRAILING_LETTER = re.compile(r"\b([A-E])\s*[.)]?\s*$", re.IGNORECASE)
+_NUMBER = re.compile(r"-?\d+(?:,\d{3})*(?:\.\d+)?(?:\s*/\s*\d+)?")
+_WRAPPERS = "\"'*` \n\t"
+_FINAL_LINE = re.compile(r"final\s+answer(?:\s+is)?\s*:[\s*]*", re.IGNORECASE) #"final answer" used as a label, not in prose
+_ANSWER_BLOCK_END = re.compile(r"\S[^\n]*\n[ \t]*\n") #answer text followed by a blank line
+_LETTER_ONLY = re.compile(r"^\(?([A-E])\)?\.?$", re.IGNORECASE)
+_MULTI_BLOCK = re.compile(r"```|~~~|^[ \t]*(?:\d+[.)]|[-*\u2022]|step\s+\d+)[ \t]|:[ \t]*$", re.IGNORECASE | re.MULTILINE) #lists, code, "steps:"
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+def _record(kind: str) -> None:
+    with _stats_lock:
+        _stats[kind] += 1
+
+def extraction_stats() -> dict:
+    """Hit counts per pattern (plus 'miss') and the hit rate of each since the last reset."""
+    with _stats_lock:
+        total = sum(_stats.values())
+        return {kind: {"hits": _stats[kind], "rate": _stats[kind] / total if total else 0.0}
+                for kind in PATTERNS + ("miss",)}
+
+def reset_extraction_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+def _boxed_content(text: str, start: int) -> str:
+    depth = 1
+    for i in range(start, len(text)):
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i]
+    return ""
+
+def _clean(answer: str) -> str:
+    answer = answer.strip(_WRAPPERS)
+    boxed = answer.find("\\boxed{") #"Final Answer: \boxed{42}"
+    if boxed >= 0:
+        inner = _boxed_content(answer, boxed + len("\\boxed{"))
+        if inner:
+            return inner.strip()
+    letter = _LETTER_ONLY.match(answer) #"(B)" -> "B"
+    return letter.group(1).upper() if letter else answer
+
+def _last_match(pattern, text: str):
+    match = None
+    for match in pattern.finditer(text[-TAIL:]):
+        pass
+    if match is None and len(text) > TAIL:
+        for match in pattern.finditer(text):
+            pass
+    return match
+
+def extract_final_answer(ans: str, isMath: bool = False) -> str:
+    """
+    Returns the extracted answer, or the stripped input unchanged when no pattern matched
+    (callers use that to decide whether to fall back to the model).
+
+    >>> extract_final_answer("So the final answer is -5", True)
+    '-5'
+    >>> extract_final_answer("Final Answer -3", True)
+    '-3'
+    >>> extract_final_answer("Final Answer: -2.5", True)
+    '-2.5'
+    >>> extract_final_answer("Final Answer - 7", True)
+    '7'
+    >>> extract_final_answer("x = 2 or x = -4", True)
+    '-4'
+    """
+    if not ans:
+        return ""
+    ans = ans.strip()
+    lowered = ans.lower()
+    if len(lowered) != len(ans): #a few unicode characters change length when lowercased
+        lowered = "".join(ch.lower() if len(ch.lower()) == 1 else ch for ch in ans)
+    idx = lowered.rfind("final answer") #last occurrence wins
+    if idx >= 0:
+        start = _FINAL_SUFFIX.match(ans, idx + len("final answer")).end()
+        answer = _clean(ans[start:])
+        if answer:
+            _record("final")
+            return answer
+    idx = ans.rfind("\\boxed{")
+    if idx >= 0:
+        answer = _boxed_content(ans, idx + len("\\boxed{")).strip()
+        if answer:
+            _record("boxed")
+            return answer
+    if "answer" in lowered:
+        match = _last_match(_ANSWER_LINE, ans)
+        if match:
+            answer = _clean(match.string[match.end():])
+            if answer:
+                _record("answer")
+                return answer
+    match = _last_match(_MC, ans)
+    if match:
+        _record("mc")
+        return next(group for group in match.groups() if group).upper()
+    match = _TRAILING_LETTER.search(ans[-8:]) #answer ends with a letter
+    if match:
+        _record("letter")
+        return match.group(1).upper()
+    if isMath: #assuming its a math problem, worst case extract last number
+        match = _last_match(_NUMBER, ans)
+        if match:
+            _record("number")
+            return re.sub(r"[,\s]", "", match.group())
+    _record("miss")
+    return ans
+
+def final_answer_complete(text: str) -> bool:
+    r"""
+    Stop predicate for streamed reasoning: True once a "Final Answer:" line has been written and the
+    answer is finished, i.e. followed by a blank line. Answers that contain a list item or a code
+    fence (plans, code) may have blank lines inside them, so they are never cut and stream to the end.
+
+    >>> final_answer_complete("Final Answer: 42\n\n")
+    True
+    >>> final_answer_complete("Final Answer:\n1. pick up A\n\n2. stack A on B\n\n")
+    False
+    >>> final_answer_complete("Final Answer: 1. pick up A\n\n2. stack A on B\n\n")
+    False
+    >>> final_answer_complete("Final Answer:\n```python\ndef f():\n    x = 1\n\n    return x\n```\n\n")
+    False
+    """
+    match = None
+    for match in _FINAL_LINE.finditer(text, max(0, len(text) - TAIL)):
+        pass
+    if match is None:
+        return False
+    end = _ANSWER_BLOCK_END.search(text, match.end())
+    return end is not None and _MULTI_BLOCK.search(text[match.end():end.end()]) is None
@@ -4,18 +4,41 @@ Generate a placeholder answer file that matches the expected auto-grader format.
 
 Reads the input questions from cse_476_final_project_test_data.json and writes
 an answers JSON file where each entry contains a string under the "output" key.
+
+Answers are streamed to a JSONL checkpoint as soon as they finish, so an
+interrupted run can be resumed; pass --fresh to discard the checkpoint.
+
+Questions whose inputs are identical after normalization are solved once and
+the answer is written for every copy. Unique questions are submitted grouped by
+routed domain, so calls sharing a strategy's system prompts reach the server
+together and can reuse its prefix cache.
 """
 
 from __future__ import annotations
 
+import argparse
+import hashlib
 import json
+import os
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Any, Dict, List
 from tqdm import tqdm
 from agent import run_agent
+from api import get_request_count
+from router import classify_domain
+from tracing import export_cot_traces, export_records, export_summary, question
 
 INPUT_PATH = Path("cse_476_final_project_test_data.json")
 OUTPUT_PATH = Path("cse_476_final_project_answers.json")
+CHECKPOINT_PATH = Path("cse_476_final_project_answers.checkpoint.jsonl")
+NUM_WORKERS = int(os.getenv("NUM_WORKERS", "16"))
+TRACE_PATH = Path(os.getenv("TRACE_PATH", "cse_476_final_project_trace.jsonl"))
+TRACE_SUMMARY_PATH = Path(os.getenv("TRACE_SUMMARY_PATH", "cse_476_final_project_trace_summary.csv"))
+COT_TRACE_PATH = Path(os.getenv("COT_TRACE_PATH", "cse_476_final_project_trace_cot.jsonl"))
+DEDUPE_QUESTIONS = os.getenv("DEDUPE_QUESTIONS", "1") != "0"
 
 
 def load_questions(path: Path) -> List[Dict[str, Any]]:
@@ -26,16 +49,199 @@ def load_questions(path: Path) -> List[Dict[str, Any]]:
     return data
 
 
-def build_answers(questions: List[Dict[str, Any]]) -> List[Dict[str, str]]:
-    answers = []
-    for question in tqdm(questions, desc="Generating Answers"):
-        prompt = question["input"]
-        domain = question.get("domain", "unknown") 
-        prediction = run_agent(prompt)
-        answers.append({"output": prediction})
+def scan_checkpoint(path: Path) -> Dict[int, int]:
+    """Map question index -> byte offset of its line in the checkpoint file.
+
+    A partially written trailing line (e.g. from a crash mid-write) is ignored.
+    """
+    offsets: Dict[int, int] = {}
+    if not path.exists():
+        return offsets
+    with path.open("rb") as fp:
+        offset = fp.tell()
+        for line in iter(fp.readline, b""):
+            try:
+                record = json.loads(line)
+                offsets[int(record["index"])] = offset
+            except (ValueError, KeyError, TypeError):
+                pass
+            offset = fp.tell()
+    return offsets
+
+
+def _drop_partial_line(path: Path) -> None:
+    """Truncate a trailing line left unfinished by a crash so appends start on a fresh line."""
+    if not path.exists():
+        return
+    with path.open("rb+") as fp:
+        end = fp.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:  # scan backwards in blocks for the last newline
+            size = min(4096, pos)
+            pos -= size
+            fp.seek(pos)
+            block = fp.read(size)
+            if pos + size == end and block.endswith(b"\n"):
+                return
+            newline = block.rfind(b"\n")
+            if newline >= 0:
+                fp.truncate(pos + newline + 1)
+                return
+        fp.truncate(0)
+
+
+def input_key(text: str) -> str:
+    """Hash of the normalized input used to spot near-duplicate questions.
+
+    Normalization: NFKC and collapsed whitespace only. Case and punctuation can change the
+    answer (a cased string to reverse, "2+3" vs "2+3?"), so they are kept.
+    """
+    normalized = " ".join(unicodedata.normalize("NFKC", text).split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def group_duplicates(questions: List[Dict[str, Any]], indices: List[int]) -> Dict[str, List[int]]:
+    """Map input key -> indices sharing that input, ordered by routed domain (local, no model call).
+
+    Ordering by domain only makes questions that use the same strategy likely to be in flight at the
+    same time; it does not batch them, so prefix-cache reuse on the server is a side effect at best.
+    """
+    groups: Dict[str, List[int]] = {}
+    for idx in indices:
+        groups.setdefault(input_key(questions[idx]["input"]), []).append(idx)
+    domains = {key: classify_domain(questions[group[0]]["input"])[0] for key, group in groups.items()}
+    return dict(sorted(groups.items(), key=lambda item: (domains[item[0]], item[1][0])))
+
+
+def answer_question(idx: int, prompt: str) -> str:
+    with question(idx):  # tags every model call made for this question
+        return run_agent(prompt)
+
+
+def build_answers(
+    questions: List[Dict[str, Any]],
+    num_workers: int = NUM_WORKERS,
+    checkpoint_path: Path = CHECKPOINT_PATH,
+    resume: bool = True,
+    dedupe: bool = DEDUPE_QUESTIONS,
+) -> int:
+    """Answer every question not already in the checkpoint; returns how many were answered.
+
+    A question that raises is logged and left out of the checkpoint, so the next
+    resumed run retries it. On Ctrl-C (or any other error) queued questions are
+    cancelled, the ones already running are written as they finish, and the
+    error is re-raised.
+
+    With dedupe, duplicate inputs are solved once and the answer is fanned out to
+    every index; a duplicate of a question already in the checkpoint reuses its answer.
+    """
+    # Questions run concurrently; the number of requests actually in flight is
+    # capped globally in api.py (MAX_INFLIGHT_REQUESTS), so num_workers only
+    # bounds how many questions are being worked on at once.
+    if resume:
+        _drop_partial_line(checkpoint_path)
+    done = scan_checkpoint(checkpoint_path) if resume else {}
+    pending = [idx for idx in range(len(questions)) if idx not in done]
+    if done:
+        print(f"Resuming: {len(done)} answers already in {checkpoint_path}")
+    if dedupe:
+        groups = group_duplicates(questions, pending)
+        reused = _answers_for(questions, done, groups, checkpoint_path)
+        if len(groups) < len(pending) or reused:
+            print(f"Deduplicated {len(pending)} questions into {len(groups) - len(reused)} unique inputs to solve")
+    else:
+        groups, reused = {str(idx): [idx] for idx in pending}, {}
+    start = time.perf_counter()
+    start_requests = get_request_count()
+    answered = failed = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, num_workers))
+    with checkpoint_path.open("a" if resume else "w", encoding="utf-8") as checkpoint, \
+            tqdm(total=len(pending), desc="Generating Answers") as progress:
+
+        def write_answers(indices: List[int], output: str) -> None:
+            nonlocal answered
+            for idx in indices:
+                record = {"index": idx, "output": output}
+                checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+            checkpoint.flush()
+            answered += len(indices)
+            progress.update(len(indices))
+
+        def collect(futures) -> None:
+            nonlocal failed
+            for future in as_completed(futures):
+                unfinished.discard(future)
+                indices = groups[future_to_key[future]]
+                try:
+                    output = future.result()
+                except Exception as exc:  # one bad question must not sink the run
+                    failed += len(indices)
+                    tqdm.write(f"Question {indices[0]} failed, will be retried on resume: {exc!r}")
+                    continue
+                write_answers(indices, output)
+
+        for key, output in reused.items():
+            write_answers(groups[key], output)
+        future_to_key = {
+            executor.submit(answer_question, group[0], questions[group[0]]["input"]): key
+            for key, group in groups.items() if key not in reused
+        }
+        unfinished = set(future_to_key)
+        try:
+            collect(unfinished)
+        except BaseException:  # Ctrl-C or a write error: stop queued questions, keep running ones
+            executor.shutdown(wait=False, cancel_futures=True)
+            running = [future for future in unfinished if not future.cancelled()]
+            if running:
+                tqdm.write(f"Stopping: waiting for {len(running)} running questions to finish")
+                collect(running)
+            raise
+        finally:
+            executor.shutdown(wait=True)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    num_requests = get_request_count() - start_requests
+    print(
+        f"Answered {answered} questions in {elapsed:.1f}s "
+        f"({answered / elapsed:.2f} questions/sec, "
+        f"{num_requests / elapsed:.2f} requests/sec, {num_requests} requests)"
+    )
+    if failed:
+        print(f"{failed} questions failed; run again to retry them from the checkpoint")
+    return answered
+
+
+def _answers_for(
+    questions: List[Dict[str, Any]], done: Dict[int, int], groups: Dict[str, List[int]], checkpoint_path: Path
+) -> Dict[str, str]:
+    """Answers already in the checkpoint for any of the pending input keys."""
+    answers: Dict[str, str] = {}
+    if not done:
+        return answers
+    with checkpoint_path.open("rb") as fp:
+        for idx, offset in done.items():
+            if idx >= len(questions):
+                continue
+            key = input_key(questions[idx]["input"])
+            if key in groups and key not in answers:
+                fp.seek(offset)
+                answers[key] = json.loads(fp.readline())["output"]
     return answers
 
 
+def validate_answer(idx: int, answer: Dict[str, Any]) -> None:
+    if "output" not in answer:
+        raise ValueError(f"Missing 'output' field for answer index {idx}.")
+    if not isinstance(answer["output"], str):
+        raise TypeError(
+            f"Answer at index {idx} has non-string output: {type(answer['output'])}"
+        )
+    if len(answer["output"]) >= 5000:
+        raise ValueError(
+            f"Answer at index {idx} exceeds 5000 characters "
+            f"({len(answer['output'])} chars). Please make sure your answer does not include any intermediate results."
+        )
+
+
 def validate_results(
     questions: List[Dict[str, Any]], answers: List[Dict[str, Any]]
 ) -> None:
@@ -44,34 +250,73 @@ def validate_results(
             f"Mismatched lengths: {len(questions)} questions vs {len(answers)} answers."
         )
     for idx, answer in enumerate(answers):
-        if "output" not in answer:
-            raise ValueError(f"Missing 'output' field for answer index {idx}.")
-        if not isinstance(answer["output"], str):
-            raise TypeError(
-                f"Answer at index {idx} has non-string output: {type(answer['output'])}"
-            )
-        if len(answer["output"]) >= 5000:
-            raise ValueError(
-                f"Answer at index {idx} exceeds 5000 characters "
-                f"({len(answer['output'])} chars). Please make sure your answer does not include any intermediate results."
-            )
+        validate_answer(idx, answer)
 
 
-def main() -> None:
-    questions = load_questions(INPUT_PATH)
-    answers = build_answers(questions)
+def compact_checkpoint(
+    questions: List[Dict[str, Any]],
+    checkpoint_path: Path = CHECKPOINT_PATH,
+    output_path: Path = OUTPUT_PATH,
+) -> int:
+    """Write the checkpoint out as the final JSON array, validating each answer as it goes.
 
-    with OUTPUT_PATH.open("w") as fp:
-        json.dump(answers, fp, ensure_ascii=False, indent=2)
+    Only the index -> offset map is held in memory; answers are read back one at a
+    time in question order. The output is written to a temporary file and moved into
+    place once every answer has passed validation.
+    """
+    offsets = scan_checkpoint(checkpoint_path)
+    if len(offsets) != len(questions) or any(idx not in offsets for idx in range(len(questions))):
+        raise ValueError(
+            f"Mismatched lengths: {len(questions)} questions vs {len(offsets)} answers."
+        )
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    with checkpoint_path.open("rb") as src, tmp_path.open("w", encoding="utf-8") as out:
+        out.write("[" if questions else "[]")
+        for idx in range(len(questions)):
+            src.seek(offsets[idx])
+            answer = {"output": json.loads(src.readline())["output"]}
+            validate_answer(idx, answer)
+            entry = json.dumps(answer, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            out.write(("\n  " if idx == 0 else ",\n  ") + entry)
+        if questions:
+            out.write("\n]")
+    os.replace(tmp_path, output_path)
+    return len(questions)
+
+
+def print_trace_summary(rows: List[Dict[str, Any]]) -> None:
+    print(f"Per-call trace written to {TRACE_PATH}, summary to {TRACE_SUMMARY_PATH}, CoT traces to {COT_TRACE_PATH}")
+    print(f"{'strategy':<30}{'step':<13}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'tokens':>10}")
+    for row in rows:
+        tokens = row["prompt_tokens_total"] + row["completion_tokens_total"]
+        print(
+            f"{row['strategy']:<30}{row['step']:<13}{row['calls']:>7}"
+            f"{row['wall_ms_p50']:>10.0f}{row['wall_ms_p95']:>10.0f}{row['wall_ms_p99']:>10.0f}{tokens:>10.0f}"
+        )
 
-    with OUTPUT_PATH.open("r") as fp:
-        saved_answers = json.load(fp)
-    validate_results(questions, saved_answers)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--fresh", action="store_true", help="ignore any existing checkpoint and start over"
+    )
+    args = parser.parse_args()
+
+    questions = load_questions(INPUT_PATH)
+    build_answers(questions, resume=not args.fresh)
+    export_records(TRACE_PATH)
+    export_cot_traces(COT_TRACE_PATH)
+    print_trace_summary(export_summary(TRACE_SUMMARY_PATH))
+    answered = scan_checkpoint(CHECKPOINT_PATH)
+    missing = sum(idx not in answered for idx in range(len(questions)))
+    if missing:
+        raise SystemExit(f"{missing} questions have no answer yet; run again to resume.")
+    num_answers = compact_checkpoint(questions)
     print(
-        f"Wrote {len(answers)} answers to {OUTPUT_PATH} "
+        f"Wrote {num_answers} answers to {OUTPUT_PATH} "
         "and validated format successfully."
     )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
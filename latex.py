@@ -0,0 +1,280 @@
+"""
+latex.py
+
+Local LaTeX detection and a deterministic LaTeX -> plain text converter for the common constructs
+in math prompts (\\frac, ^, _, \\sqrt, Greek letters, \\sum, \\int, ...). Follows the same verbal
+mappings as the conversion_sys_prompt in strategies.py: inside math segments operators become words
+(+ -> plus, = -> equals, ...) and fractions next to other terms are parenthesised. to_plain_text
+returns None for anything it doesn't know how to convert (matrices, d/dx derivatives, ...) so the
+caller can fall back to the model.
+"""
+import re
+
+_LATEX_RE = re.compile(r"\\[a-zA-Z]+|\\[(\[$%]|[\^_]\{|\$[^$]*[\\^_{}][^$]*\$")
+_SEGMENT_RE = re.compile(r"\$\$(.+?)\$\$|\$(.+?)\$|\\\((.+?)\\\)|\\\[(.+?)\\\]", re.DOTALL)
+_MATH_SEGMENT_RE = re.compile(r"[\\^_{}=<>+*/()']|^\s*[A-Za-z]\s*$|^\s*-?\d+(?:\.\d+)?\s*$")
+_SIMPLE_RE = re.compile(r"^[\w.']+$")
+_TEXT_SCRIPT_RE = re.compile(r"^\{?\s*\\(?:text|textrm|mathrm|mbox)\s*\{") #"^{\text{th}}" is an ordinal suffix, not a power
+_DIFFERENTIAL_RE = re.compile(r"^\{?\s*(?:d|\\partial)\s*[a-zA-Z]\w*\s*(?:\^\s*\{?\w+\}?)?\s*\}?$") #"{dx}", "{\\partial x}", "{dx^2}"
+_D_NUMERATOR_RE = re.compile(r"^\{?\s*(?:d|\\partial)(?![a-zA-Z]{2})") #"{d}", "{dy}", "{d^2 y}", "{\\partial f}"
+
+GREEK = {name: name for name in (
+    "alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta", "iota", "kappa", "lambda",
+    "mu", "nu", "xi", "pi", "rho", "sigma", "tau", "upsilon", "phi", "chi", "psi", "omega",
+    "Gamma", "Delta", "Theta", "Lambda", "Xi", "Pi", "Sigma", "Phi", "Psi", "Omega",
+)}
+GREEK.update({"varepsilon": "epsilon", "vartheta": "theta", "varphi": "phi"})
+
+OPERATORS = {"+": " plus ", "-": " minus ", "=": " equals ", "<": " less than ", ">": " greater than ",
+             "*": " times ", "/": " divided by "}
+PROSE_OPERATORS = "+=<>" #bare LaTeX in prose: "-", "/" and "*" are hyphens, slashes and markdown there
+
+SYMBOLS = {
+    "cdot": " times ", "times": " times ", "div": " divided by ", "pm": " plus or minus ",
+    "mp": " minus or plus ", "le": " less than or equal to ", "leq": " less than or equal to ",
+    "ge": " greater than or equal to ", "geq": " greater than or equal to ", "neq": " not equal to ",
+    "ne": " not equal to ", "approx": " approximately equal to ", "equiv": " is congruent to ",
+    "lt": " less than ", "gt": " greater than ", "infty": "infinity", "to": " approaches ",
+    "rightarrow": " -> ", "Rightarrow": " implies ", "in": " in ", "notin": " not in ",
+    "subset": " subset of ", "subseteq": " subset of or equal to ", "cup": " union ", "cap": " intersect ",
+    "forall": "for all ", "exists": "there exists ", "angle": "angle ", "triangle": "triangle ",
+    "circ": " degrees", "degree": " degrees", "perp": " perpendicular to ", "parallel": " parallel to ",
+    "ldots": "...", "cdots": "...", "dots": "...", "vdots": "...", "%": " percent", "$": "$",
+    "{": "{", "}": "}", "|": "|", "mid": " divides ", "nmid": " does not divide ", "prime": "'",
+    ",": " ", ";": " ", ":": " ", "!": "", " ": " ", "quad": " ", "qquad": " ", "\\": "\n",
+    "left": "", "right": "", "big": "", "Big": "", "bigg": "", "Bigg": "", "displaystyle": "",
+    "limits": "", "lfloor": "floor(", "rfloor": ")", "lceil": "ceiling(", "rceil": ")",
+    "langle": "<", "rangle": ">",
+}
+FUNCTIONS = ("sin", "cos", "tan", "sec", "csc", "cot", "arcsin", "arccos", "arctan", "sinh", "cosh",
+             "tanh", "log", "ln", "exp", "max", "min", "gcd", "lcm", "det", "deg", "mod", "bmod")
+TEXT_COMMANDS = ("text", "textbf", "textit", "mathrm", "mathbf", "mathit", "operatorname", "mbox", "mathbb")
+BIG_OPERATORS = {"sum": "sum", "prod": "product", "int": "integral", "oint": "integral",
+                 "bigcup": "union", "bigcap": "intersection"}
+ROOT_WORDS = {"2": "square", "3": "cube"}
+
+
+class Unsupported(Exception):
+    pass
+
+
+def has_latex(prompt: str) -> bool:
+    return bool(prompt) and _LATEX_RE.search(prompt) is not None
+
+
+def _wrapped(text: str) -> bool:
+    """True if text is one parenthesised group, e.g. "(a over b)" but not "(a) plus (b)"."""
+    if not (text.startswith("(") and text.endswith(")")):
+        return False
+    depth = 0
+    for i, ch in enumerate(text):
+        depth += ch == "("
+        depth -= ch == ")"
+        if depth == 0 and i < len(text) - 1:
+            return False
+    return True
+
+
+def _group(text: str) -> str:
+    text = text.strip()
+    return text if _SIMPLE_RE.match(text) or _wrapped(text) else f"({text})"
+
+
+class _Parser:
+    def __init__(self, src: str, math: bool = True):
+        self.src = src
+        self.i = 0
+        self.operators = OPERATORS.keys() if math else PROSE_OPERATORS
+
+    def peek(self) -> str:
+        return self.src[self.i] if self.i < len(self.src) else ""
+
+    def skip_spaces(self) -> None:
+        while self.peek().isspace():
+            self.i += 1
+
+    def command_name(self) -> str:
+        start = self.i = self.i + 1 #skip backslash
+        while self.peek().isalpha():
+            self.i += 1
+        if self.i == start:
+            self.i += 1 #single-character command such as \, or \{
+        return self.src[start:self.i]
+
+    def raw_group(self) -> str:
+        self.skip_spaces()
+        if self.peek() != "{":
+            raise Unsupported("expected {")
+        depth, start = 0, self.i
+        while self.i < len(self.src):
+            ch = self.src[self.i]
+            depth += ch == "{"
+            depth -= ch == "}"
+            self.i += 1
+            if depth == 0:
+                return self.src[start + 1:self.i - 1]
+        raise Unsupported("unbalanced braces")
+
+    def argument(self) -> str:
+        self.skip_spaces()
+        ch = self.peek()
+        if ch == "{":
+            self.i += 1
+            text = self.sequence(stop="}")
+            self.i += 1
+            return text.strip()
+        if ch == "\\":
+            return self.command().strip()
+        if not ch:
+            raise Unsupported("missing argument")
+        self.i += 1
+        return ch
+
+    def limits(self) -> tuple:
+        lower = upper = ""
+        for _ in range(2):
+            self.skip_spaces()
+            if self.peek() == "_":
+                self.i += 1
+                lower = self.argument()
+            elif self.peek() == "^":
+                self.i += 1
+                upper = self.argument()
+        return lower, upper
+
+    def command(self) -> str:
+        name = self.command_name()
+        if name in ("frac", "dfrac", "tfrac"):
+            start = self.i
+            num = self.argument()
+            raw_num, start = self.src[start:self.i].strip(), self.i
+            den = self.argument()
+            if _D_NUMERATOR_RE.match(raw_num) and _DIFFERENTIAL_RE.match(self.src[start:self.i].strip()):
+                raise Unsupported("derivative") #"derivative of ... with respect to x" needs the model
+            return f"({_group(num)} over {_group(den)})" #parenthesised so "1 over 2 plus x" can't misparse
+        if name == "binom":
+            n, k = self.argument(), self.argument()
+            return f"{_group(n)} choose {_group(k)}"
+        if name == "sqrt":
+            index = ""
+            if self.peek() == "[":
+                end = self.src.find("]", self.i)
+                if end < 0:
+                    raise Unsupported("unclosed root index")
+                index, self.i = self.src[self.i + 1:end].strip(), end + 1
+            word = ROOT_WORDS.get(index or "2", f"{index}-th")
+            return f"{word} root of {_group(self.argument())}"
+        if name in BIG_OPERATORS:
+            lower, upper = self.limits()
+            words = BIG_OPERATORS[name]
+            if lower:
+                words += f" from {lower}"
+            if upper:
+                words += f" to {_group(upper)}"
+            return words + " of "
+        if name == "lim":
+            lower, _ = self.limits()
+            return f"limit as {lower.strip()} of " if lower else "limit of "
+        if name in TEXT_COMMANDS:
+            return self.raw_group()
+        if name in GREEK:
+            return GREEK[name]
+        if name in FUNCTIONS:
+            return name
+        if name in SYMBOLS:
+            return SYMBOLS[name]
+        raise Unsupported(f"\\{name}")
+
+    def script(self, kind: str) -> str:
+        self.skip_spaces()
+        start = self.i
+        arg = self.argument()
+        if kind == "^" and _TEXT_SCRIPT_RE.match(self.src[start:self.i]):
+            return arg.strip()
+        if kind == "_":
+            return f" sub {_group(arg)}"
+        if arg == "degrees":
+            return " degrees"
+        if arg == "'":
+            return arg
+        if arg == "2":
+            return " squared"
+        if arg == "3":
+            return " cubed"
+        return f" to the power of {_group(arg)}"
+
+    def sequence(self, stop: str = "") -> str:
+        out = []
+        while self.i < len(self.src):
+            ch = self.src[self.i]
+            if stop and ch == stop:
+                return "".join(out)
+            if ch == "\\":
+                text = self.command()
+                if out and out[-1][-1:].isalnum() and text[:1].isalnum():
+                    out.append(" ") #keep "2\pi r" from running together
+                out.append(text)
+                if text[-1:].isalnum() and self.peek().isalnum():
+                    out.append(" ")
+            elif ch in "^_":
+                self.i += 1
+                text = self.script(ch)
+                out.append(text)
+                if text[-1:].isalnum() and self.peek().isalnum():
+                    out.append(" ") #"x^{2}y" -> "x squared y"
+            elif ch == "{":
+                self.i += 1
+                out.append(self.sequence(stop="}"))
+                self.i += 1
+            elif ch == "}":
+                raise Unsupported("unbalanced braces")
+            elif ch == "&":
+                raise Unsupported("alignment / matrix")
+            elif ch in self.operators:
+                out.append(OPERATORS[ch])
+                self.i += 1
+            else:
+                out.append(ch)
+                self.i += 1
+        if stop:
+            raise Unsupported("unbalanced braces")
+        return "".join(out)
+
+
+def _convert(text: str, math: bool = True) -> str:
+    converted = re.sub(r"[ \t]+", " ", _Parser(text, math).sequence()).strip()
+    return converted[1:-1] if _wrapped(converted) else converted #a lone fraction needs no parentheses
+
+
+def to_plain_text(prompt: str):
+    r"""Converts LaTeX in prompt to plain text, or returns None if it uses unsupported constructs.
+
+    >>> to_plain_text(r"$\frac{1}{2}+x^2$")
+    '(1 over 2) plus x squared'
+    >>> to_plain_text(r"Find the $1314^{\text{th}}$ digit")
+    'Find the 1314th digit'
+    >>> to_plain_text(r"$x^{2}y$")
+    'x squared y'
+    >>> to_plain_text(r"$\{x | x > 0\}$")
+    '{x | x greater than 0}'
+    >>> to_plain_text(r"An angle of $30^\circ$")
+    'An angle of 30 degrees'
+    >>> to_plain_text(r"$x^{n+1}$")
+    'x to the power of (n plus 1)'
+    >>> to_plain_text(r"$\frac{d}{dx} x^2$") is None
+    True
+    >>> to_plain_text(r"It costs $5 and $10.")
+    'It costs $5 and $10.'
+    """
+    def segment(match):
+        body = next(group for group in match.groups() if group is not None)
+        if not _MATH_SEGMENT_RE.search(body): #e.g. "$5 and $" is currency, not math
+            return match.group(0)
+        return _convert(body)
+    try:
+        converted = _SEGMENT_RE.sub(segment, prompt)
+        if has_latex(converted): #bare LaTeX outside of $...$
+            converted = _convert(converted, math=False)
+    except Unsupported:
+        return None
+    return re.sub(r"[ \t]+", " ", converted).strip()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+mock_server.py
+
+Deterministic, OpenAI-compatible stand-in for the model endpoint so the agent can be benchmarked
+offline. Serves POST /v1/chat/completions (blocking with n >= 1 choices, and SSE streaming) with:
+- canned outputs chosen from the system prompt of each strategy step (routing, LaTeX conversion,
+  CoT, extraction, self_refine feedback and revision, assumptions), or replayed responses from the
+  on-disk response cache (--replay)
+- a configurable lognormal latency distribution and token streaming speed
+- configurable 5xx / 429 error rates
+
+Every random choice is seeded from --seed and the request body, so the same request always gets the
+same answer. Latency and injected errors are also seeded by the attempt number of that body, so a
+retry of a failed request rolls again (as against a real server) while a rerun sees the same sequence.
+
+Usage:
+    python mock_server.py [--port 8000] [--latency-ms 400] [--error-rate 0.02] [--replay]
+    API_BASE=http://127.0.0.1:8000/v1 python generate_answer_template.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from cache import CACHE_PATH, ResponseCache, make_key
+from router import classify_domain
+
+SAMPLED_ANSWERS = ("42", "42", "42", "42.0", "7")  # sampled CoT answers mostly agree, like an easy item
+
+
+class MockConfig:
+    def __init__(
+        self,
+        latency_ms: float = 400.0,
+        latency_sigma: float = 0.5,
+        tokens_per_sec: float = 200.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: int = 0,
+        replay: Optional[ResponseCache] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+        self.replay = replay
+        self.requests = 0
+        self.attempts = {}  # body digest -> times seen, so retries get a fresh error roll
+        self.lock = threading.Lock()
+
+
+def _rng(config: MockConfig, body: bytes, attempt: int = 0) -> random.Random:
+    digest = hashlib.sha256(f"{config.seed}:{attempt}:".encode() + body).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def canned_response(system: str, prompt: str, temperature: float, rng: random.Random) -> str:
+    """Plausible output for each strategy step, keyed off its system prompt (or, in a conversation, its last turn)."""
+    lowered = system.lower()
+    request = prompt.lower()
+    if "act as a critical evaluator" in request:
+        score = rng.choice(("0.8", "0.5"))
+        return f"The answer is mostly correct. Consider tightening the explanation.\nSCORE: {score}"
+    if "generate a revised" in request:
+        return "Revised answer: step 1, step 2, step 3."
+    if "topic domain" in lowered:
+        return classify_domain(prompt)[0]
+    if "latex" in lowered and "plaintext converter" in lowered:
+        return prompt
+    if "extract the complete final answer" in lowered:
+        return "42"
+    if "extract all implicit assumptions" in lowered:
+        return "1. Current trends continue.\n2. No unexpected external events occur."
+    if "'final answer:'" in lowered:  # CoT and assumption-aware reasoning
+        answer = rng.choice(SAMPLED_ANSWERS) if temperature > 0 else "42"
+        return (
+            "Let's work through the problem step by step.\n"
+            "First, identify the quantities involved. Then combine them carefully.\n"
+            f"Final Answer: {answer}\n\n"
+            "This concludes the solution; the remaining text is filler the model keeps generating."
+        )
+    return "42"
+
+
+def _usage(prompt_text: str, completion: str) -> dict:
+    prompt_tokens = max(1, len(prompt_text) // 4)
+    completion_tokens = max(1, len(completion) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def make_handler(config: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like a real server
+
+        def log_message(self, *args) -> None:  # quiet
+            pass
+
+        def _send_json(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": "not found"})
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            digest = hashlib.sha256(body).digest()
+            with config.lock:
+                config.requests += 1
+                attempt = config.attempts.get(digest, 0)
+                config.attempts[digest] = attempt + 1
+            payload = json.loads(body)
+            rng = _rng(config, body)  # content: identical for every attempt
+            roll_rng = _rng(config, body, attempt + 1)  # latency and errors: rolled per attempt
+            messages = payload.get("messages", [])
+            system = next((m["content"] for m in messages if m["role"] == "system"), "")
+            prompt = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+            history = messages[1:-1] if len(messages) > 2 else None
+            temperature = float(payload.get("temperature", 0.0))
+
+            latency = config.latency_ms * math.exp(roll_rng.gauss(0, config.latency_sigma) - config.latency_sigma ** 2 / 2)
+            roll = roll_rng.random()
+            if roll < config.rate_limit_rate:
+                time.sleep(latency / 10000)
+                self._send_json(429, {"error": "rate limited"}, {"Retry-After": "0.2"})
+                return
+            if roll < config.rate_limit_rate + config.error_rate:
+                time.sleep(latency / 1000)
+                self._send_json(503, {"error": "mock server error"})
+                return
+
+            text = None
+            if config.replay is not None:
+                key = make_key(payload.get("model"), system, prompt, temperature, payload.get("max_tokens"), history)
+                hit = config.replay.get(key)
+                text = hit["text"] if hit else None
+            if text is None:
+                text = canned_response(system, prompt, temperature, rng)
+            usage = _usage(json.dumps(messages), text)
+
+            if payload.get("stream"):
+                self._stream(text, usage, latency, payload)
+                return
+            texts = [text] + [canned_response(system, prompt, temperature, rng) for _ in range(int(payload.get("n") or 1) - 1)]
+            completion_tokens = sum(_usage("", t)["completion_tokens"] for t in texts)
+            usage.update(completion_tokens=completion_tokens, total_tokens=usage["prompt_tokens"] + completion_tokens)
+            time.sleep((latency + max(len(t) // 4 for t in texts) / config.tokens_per_sec * 1000) / 1000)  # choices decode in parallel
+            self._send_json(200, {
+                "id": "mock", "object": "chat.completion", "model": payload.get("model"),
+                "choices": [{"index": i, "message": {"role": "assistant", "content": t}, "finish_reason": "stop"}
+                            for i, t in enumerate(texts)],
+                "usage": usage,
+            })
+
+        def _stream(self, text: str, usage: dict, latency: float, payload: dict) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            time.sleep(latency / 1000)  # time to first token
+            pieces = [text[i:i + 4] for i in range(0, len(text), 4)]  # ~1 token per piece
+            try:
+                for piece in pieces:
+                    chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(1 / config.tokens_per_sec)
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):  # client stopped early
+                pass
+            self.close_connection = True
+
+    return Handler
+
+
+def start_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Starts the mock server on a background thread; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=400.0, help="median-ish time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal spread of latency")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction answered with 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", action="store_true", help="serve recorded responses from the response cache first")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+        replay=ResponseCache(CACHE_PATH) if args.replay else None,
+    )
+    server = start_server(config, args.host, args.port)
+    print(f"Mock model server on http://{args.host}:{server.server_address[1]}/v1 (Ctrl-C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
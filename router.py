@@ -0,0 +1,91 @@
+"""
+router.py
+
+Local, zero-call domain router. Scores each prompt against keyword/regex features for the five
+domains (Math, Common Sense, Future Prediction, Coding, Planning) and only falls back to the
+LLM router (strategies.get_domain) when the local classifier isn't confident.
+"""
+import os, re
+from strategies import get_domain
+
+DOMAINS = ("Math", "Common Sense", "Future Prediction", "Coding", "Planning")
+MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.7"))
+MIN_SCORE = 2 #a single weak feature isn't enough evidence on its own
+MIN_FEATURES = 2 #full confidence needs at least this many features agreeing
+
+_I = re.IGNORECASE
+FEATURES = { #(pattern, weight)
+    "Math": [
+        (re.compile(r"\$[^$\n]+\$|\\\(|\\\["), 3), #inline/display LaTeX
+        (re.compile(r"\\(?:frac|sqrt|cdot|times|pi|le|ge|leq|geq|sum|int|binom|log|sin|cos|tan|angle|triangle)\b"), 3),
+        (re.compile(r"\b(?:how many|how much|calculate|compute|evaluate|simplify|solve for|find the (?:value|sum|product|number|remainder|area|perimeter))\b", _I), 2),
+        (re.compile(r"\d\s*[-+*/^=<>]\s*\d"), 1),
+        (re.compile(r"\b(?:equation|integer|polynomial|probability|remainder|divisible|digits?|percent|prime|fraction|ratio|average|sum of)\b", _I), 2),
+        (re.compile(r"\b(?:triangle|circle|radius|perimeter|area|square units|degrees)\b", _I), 1),
+        (re.compile(r"\$\d|\b\d+(?:\.\d+)? ?(?:dollars|cents|miles|hours|minutes|km|kg|pounds)\b", _I), 2),
+    ],
+    "Coding": [
+        (re.compile(r"```|\bdef \w+\(|\bimport \w+|\bfrom \w+ import\b"), 3),
+        (re.compile(r"\btask_func\b"), 4),
+        (re.compile(r"\b(?:python|javascript|java|c\+\+|function|dataframe|pandas|numpy|matplotlib|regex|json|csv|api)\b", _I), 2),
+        (re.compile(r"\b(?:write|implement|complete) (?:a|the) (?:function|program|script|code|class)\b", _I), 3),
+        (re.compile(r"^\s*(?:Parameters?|Returns?|Raises?|Requirements?|Example)s?:", _I | re.MULTILINE), 2),
+    ],
+    "Planning": [
+        (re.compile(r"\[PLAN\]|\[STATEMENT\]|\[PLAN END\]"), 4),
+        (re.compile(r"\bmy plan is\b|\bgoal is to have\b|\binitial conditions?\b", _I), 3),
+        (re.compile(r"\b(?:unstack|pick up|put down|stack)\b.*\bblocks?\b|\bblocks?\b.*\b(?:unstack|pick up|put down|stack)\b", _I | re.DOTALL), 3),
+        (re.compile(r"\b(?:actions? (?:I|you) can do|preconditions?|the following restrictions)\b", _I), 2),
+        (re.compile(r"\b(?:craves|harmony|province|planet|succumb|overcome|feast)\b", _I), 2),
+        (re.compile(r"\b(?:plan|schedule|itinerary|steps? to)\b", _I), 1),
+    ],
+    "Future Prediction": [
+        (re.compile(r"\bevent to be predicted\b|\bpredict future events?\b", _I), 4),
+        (re.compile(r"\\boxed\{YOUR_PREDICTION\}|\bYOUR_PREDICTION\b"), 4),
+        (re.compile(r"\b(?:predict|prediction|forecast|will happen|be announced)\b", _I), 2),
+        (re.compile(r"\b(?:will|going to)\b[^.?!]*\b20[2-9]\d\b", _I), 2),
+        (re.compile(r"\b(?:by|before|after|on) (?:January|February|March|April|May|June|July|August|September|October|November|December)\b[^.?!]*\b20[2-9]\d\b", _I), 1),
+    ],
+    "Common Sense": [
+        (re.compile(r"^\s*(?:is|are|was|were|did|does|do|can|could|would|who|whom|which|where|when|what|why)\b", _I), 2),
+        (re.compile(r"\b(?:answer choices|choices|options)\s*:", _I), 2),
+        (re.compile(r"(?:^|\n)\s*\(?[A-E][).:]\s+\S", _I), 2),
+        (re.compile(r"\byes or no\b", _I), 2),
+        (re.compile(r"\b(?:most likely|common sense|typically|usually|people)\b", _I), 1),
+    ],
+}
+
+def score_domains(prompt: str) -> dict:
+    return {domain: sum(weight for _, weight in _hits(features, prompt)) for domain, features in FEATURES.items()}
+
+def _hits(features: list, prompt: str) -> list:
+    return [(pattern, weight) for pattern, weight in features if pattern.search(prompt)]
+
+def classify_domain(prompt: str) -> tuple:
+    """
+    Returns (domain, confidence) from the local classifier. Confidence is the winning score's
+    share of the top two scores, scaled down when the winning score is below MIN_SCORE or fewer
+    than MIN_FEATURES features fired for it, so a lone keyword ("how many", "who") goes to the LLM.
+    """
+    prompt = prompt or ""
+    scores = score_domains(prompt)
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    (top, top_score), (_, second_score) = ranked[0], ranked[1]
+    if top_score <= 0:
+        return "Common Sense", 0.0
+    features = len(_hits(FEATURES[top], prompt))
+    return top, (top_score / (top_score + second_score) * min(1.0, top_score / MIN_SCORE)
+                 * min(1.0, features / MIN_FEATURES))
+
+def match_domain(text: str) -> str:
+    for domain in DOMAINS: #LLM sometimes wraps the domain in free text
+        if re.search(re.escape(domain), text or "", re.IGNORECASE):
+            return domain
+    return ""
+
+def route_domain(prompt: str, min_confidence: float = MIN_CONFIDENCE) -> str:
+    domain, confidence = classify_domain(prompt)
+    if confidence >= min_confidence:
+        return domain
+    llm_domain = match_domain(get_domain(prompt)) #+1 call, only for low confidence prompts
+    return llm_domain if llm_domain else domain
@@ -0,0 +1,192 @@
+"""
+scheduler.py
+
+Central request scheduler around the model endpoint: a token bucket sized to the server's capacity,
+jittered exponential backoff that honours Retry-After / rate-limit headers, and a circuit breaker
+that pauses all traffic while the endpoint keeps failing instead of letting every question fail
+into its fallback path.
+"""
+import os, random, re, threading, time
+from email.utils import parsedate_to_datetime
+
+SERVER_RPS        = float(os.getenv("SERVER_RPS", "10")) #sustained requests/sec, <= 0 disables the bucket
+SERVER_BURST      = int(os.getenv("SERVER_BURST", os.getenv("MAX_INFLIGHT_REQUESTS", "8")))
+MAX_RETRIES       = int(os.getenv("MAX_RETRIES", "4"))
+BACKOFF_BASE      = float(os.getenv("BACKOFF_BASE", "0.5")) #seconds
+BACKOFF_CAP       = float(os.getenv("BACKOFF_CAP", "30"))
+BREAKER_FAILURES  = int(os.getenv("BREAKER_FAILURES", "5")) #consecutive failures before the breaker opens
+BREAKER_COOLDOWN  = float(os.getenv("BREAKER_COOLDOWN", "5"))
+BREAKER_MAX_COOLDOWN = float(os.getenv("BREAKER_MAX_COOLDOWN", "120"))
+
+RETRYABLE_STATUS = {-1, 408, 409, 425, 429, 500, 502, 503, 504}
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: str):
+    """Parses rate-limit durations such as "20", "1.5s", "250ms" or "6m0s" into seconds."""
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts) if parts else None
+
+
+def retry_after(headers: dict):
+    """Seconds the server asked us to wait (Retry-After or x-ratelimit-reset-*), or None."""
+    lowered = {k.lower(): v for k, v in (headers or {}).items()}
+    value = lowered.get("retry-after")
+    if value is not None:
+        seconds = parse_duration(value)
+        if seconds is not None:
+            return seconds
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    if str(lowered.get("x-ratelimit-remaining-requests", "")).strip() == "0":
+        for key in ("x-ratelimit-reset-requests", "x-ratelimit-reset"):
+            if key in lowered:
+                return parse_duration(lowered[key])
+    return None
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    def __init__(self, rate: float = SERVER_RPS, capacity: int = SERVER_BURST):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for the given time (server said it's rate limited)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self, deadline: float = float("inf")) -> bool:
+        """Takes a token; returns False without one if it can't be had before deadline (time.monotonic())."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate <= 0:
+                    return True
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+            if now + wait >= deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed requests and holds every caller for the cooldown.
+    After the cooldown requests go through again; another failure reopens it with a doubled cooldown.
+    """
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN):
+        self.threshold = failures
+        self.base_cooldown = self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self.open_until
+
+    def wait(self, deadline: float = float("inf")) -> bool:
+        """Blocks while the breaker is open; returns False at once if it stays open past deadline."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self.open_until - now
+            if wait <= 0:
+                return True
+            if now + wait >= deadline:
+                return False
+            time.sleep(wait)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.threshold and time.monotonic() >= self.open_until:
+                self.open_until = time.monotonic() + self.cooldown
+                self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+
+
+class RequestScheduler:
+    def __init__(self, bucket: TokenBucket = None, breaker: CircuitBreaker = None, max_retries: int = MAX_RETRIES):
+        self.bucket = bucket or TokenBucket()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+
+    def run(self, send, deadline: float = float("inf")) -> tuple:
+        """
+        Calls send() -> (result dict, queue_ms) until it succeeds, fails with a non-retryable status,
+        or runs out of retries. Returns (result, total queue_ms, retries used); queue_ms includes time
+        held by the breaker and the token bucket. No retry is started past deadline (time.monotonic()),
+        and if the breaker or the bucket would hold the request past it, the result has status -2.
+        """
+        queue_ms = 0.0
+        for attempt in range(self.max_retries + 1):
+            waiting = time.perf_counter()
+            admitted = self.breaker.wait(deadline) and self.bucket.acquire(deadline)
+            queue_ms += (time.perf_counter() - waiting) * 1000
+            if not admitted:
+                result = {"ok": False, "text": None, "raw": None, "status": -2,
+                          "error": "deadline reached while queued", "headers": {}}
+                return result, queue_ms, attempt
+            result, waited = send()
+            queue_ms += waited
+            status = result.get("status")
+            if result.get("ok"):
+                self.breaker.record_success()
+                server_wait = retry_after(result.get("headers")) #remaining requests hit 0
+                if server_wait:
+                    self.bucket.pause(server_wait)
+                return result, queue_ms, attempt
+            if status not in RETRYABLE_STATUS:
+                return result, queue_ms, attempt
+            if status != 429: #rate limiting isn't the endpoint failing
+                self.breaker.record_failure()
+            server_wait = retry_after(result.get("headers"))
+            if server_wait is not None and status == 429:
+                self.bucket.pause(server_wait) #everyone backs off, not just this caller
+            delay = server_wait if server_wait is not None else backoff_delay(attempt)
+            if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                return result, queue_ms, attempt
+            time.sleep(delay)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> RequestScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler()
+    return _scheduler
@@ -10,24 +10,51 @@ Self Refinement
 Assumption Explicit Reasoning
 
 """
-import re
-from api import call_model_chat_completions
+import re, threading
+from api import call_model_chat_completions, BATCH_SAMPLES
+from latex import has_latex, to_plain_text
+from extract import extract_final_answer, final_answer_complete
+from voting import AnswerClusters, token_similarity
+from tracing import add_question_stat, strategy, submit_in_context
+from budget import current_budget
 import random
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 
 def get_domain(prompt: str):
     sys_prompt = (
         "You are a helpful assistant. Analyze the given prompt and determine its topic domain from the following options: Math, Common Sense, Future Prediction, Coding, Planning\n"
         "If the domain is not listed in the given options, choose the BEST option from these: Math, Common Sense, Future Prediction, Coding, Planning. DO NOT make up your own domain or decide one that is not listed in the given options..\n"
         "DO NOT attempt to answer the prompt. Your answer should be one of the following (case sensitive) based on the topic of the prompt: Math, Common Sense, Future Prediction, Coding, Planning.")
-    full_response = call_model_chat_completions(prompt=prompt, system=sys_prompt, max_tokens=32)
+    full_response = call_model_chat_completions(prompt=prompt, system=sys_prompt, max_tokens=32, step="route")
     res = full_response.get("text", "")
     #print("Extracted text:", repr(res))
     # if not res:
     #     print("Full response:", full_response)
     return res.strip() if res else ""
 
+MAX_CONVERSIONS = 1024
+_conversions = {} #prompt -> plain text, successful conversions only
+_conversions_lock = threading.Lock()
+
+def clear_conversion_cache() -> None:
+    with _conversions_lock:
+        _conversions.clear()
+
+def _remember_conversion(prompt: str, converted: str) -> str:
+    with _conversions_lock:
+        if len(_conversions) < MAX_CONVERSIONS:
+            _conversions[prompt] = converted
+    return converted
+
 def convertToPlainText(prompt: str): #convert from Latex to plain text
+    if not has_latex(prompt): #nothing to convert, skip the call
+        return prompt
+    with _conversions_lock: #same prompt is converted at most once per run
+        if prompt in _conversions:
+            return _conversions[prompt]
+    local = to_plain_text(prompt) #rule based, None if it hits something it can't handle
+    if local is not None:
+        return _remember_conversion(prompt, local)
     conversion_sys_prompt = """
             You are a LaTeX→PlainText converter whose job is to take a user prompt that may contain mathematical expressions written in LaTeX and produce a single, unambiguous, machine-friendly plain-English representation of the math. The output will be fed back to a solver, so do not evaluate, simplify, or solve anything — only convert notation to clear words and ASCII-like tokens. Follow these rules exactly:
             1. Output format
@@ -76,62 +103,109 @@ def convertToPlainText(prompt: str): #convert from Latex to plain text
                 - Output: Let f(x) = ln(x squared plus 1). Compute f prime of x.
             Act exactly as above for every user message. Always convert math to plain text without solving or commenting.
             """
-    ans = call_model_chat_completions(prompt=prompt, system=conversion_sys_prompt, max_tokens=4096)["text"]
-    return ans.strip() if ans is not None else ""
+    ans = call_model_chat_completions(prompt=prompt, system=conversion_sys_prompt, max_tokens=4096, step="convert")["text"]
+    if not ans or not ans.strip(): #failed call, solve the original prompt this time but don't remember it
+        return prompt
+    return _remember_conversion(prompt, ans.strip())
+
+def _timeout(budget):
+    remaining = budget.remaining_time()
+    return None if remaining == float("inf") else max(0.0, remaining)
 
-def self_consistency(prompt: str, isMath: bool = False, num_samples: int = 7, verbose=False): #runs CoT in parallel
-    results = {}
+def _vote_decided(results: dict, drawn: int, num_samples: int, confidence: float, min_samples: int) -> bool:
+    if not results:
+        return False
+    counts = sorted(results.values(), reverse=True)
+    leader = counts[0]
+    runner_up = counts[1] if len(counts) > 1 else 0
+    if leader > runner_up + (num_samples - drawn): #remaining samples can't overtake the leader
+        return True
+    return drawn >= min_samples and leader / sum(counts) >= confidence
+
+@strategy("self_consistency")
+def self_consistency(prompt: str, isMath: bool = False, num_samples: int = 7, verbose=False,
+                     adaptive: bool = True, wave_size: int = 3, min_samples: int = 3, confidence: float = 1.0,
+                     similarity: float = None, stats: dict = None): #runs CoT in parallel
+    votes = AnswerClusters(similarity=similarity) #similarity = token-set threshold for merging free text answers
     if isMath:
         prompt = convertToPlainText(prompt) # 1 call
-    with ThreadPoolExecutor(max_workers=2) as executor: #simulataneous API calls
-        future_to_ans = { #each CoT = 2 max
-            executor.submit(chain_of_thought, prompt, random.uniform(0.5, 1.0), isMath=isMath): i #randomized temp
-            for i in range(num_samples)
-        }
-        for future in as_completed(future_to_ans):
-            ans = future.result()
-            if ans and ans != "": #avoid ""
-                if ans in results:
-                    results[ans] += 1
-                else:
-                    results[ans] = 1
+    if not adaptive:
+        wave_size = num_samples
+    wave_size = max(1, min(wave_size, num_samples))
+    drawn = 0
+    budget = current_budget()
+    cancel = threading.Event() #set once the vote is decided, closes the wave's remaining streams
+    executor = ThreadPoolExecutor(max_workers=wave_size) #simulataneous API calls, capped globally in api.py
+    try:
+        while drawn < num_samples: #draw samples in waves, stop once the vote is decided
+            affordable = budget.remaining_calls() // 2 #each CoT = 2 max
+            if affordable < num_samples - drawn: #shrink to what the budget still covers
+                num_samples = drawn + int(max(affordable, 0))
+            if num_samples <= drawn or budget.remaining_time() <= 0:
+                break
+            size = min(wave_size, num_samples - drawn)
+            if BATCH_SAMPLES: #whole wave in one request (n=size), the samples share the prompt prefix
+                wave = [submit_in_context(executor, chain_of_thought_samples, prompt, random.uniform(0.5, 1.0), size, isMath=isMath, cancel=cancel)]
+            else:
+                wave = [ #each CoT = 2 max
+                    submit_in_context(executor, chain_of_thought, prompt, random.uniform(0.5, 1.0), isMath=isMath, cancel=cancel) #randomized temp
+                    for _ in range(size)
+                ]
+            decided = False
+            try:
+                for future in as_completed(wave, timeout=_timeout(budget)):
+                    answers = future.result()
+                    for ans in answers if isinstance(answers, list) else [answers]:
+                        drawn += 1
+                        if ans and ans != "": #avoid ""
+                            votes.add(ans) #"42", "42.0", "$42" all vote for the same cluster
+                        if adaptive and _vote_decided(votes.counts, drawn, num_samples, confidence, min_samples):
+                            decided = True
+                            break
+                    if decided:
+                        break
+            except FuturesTimeout: #deadline hit, vote with what finished
+                decided = True
+            if decided:
+                break
+    finally:
+        cancel.set() #stop the samples still streaming in this wave
+        executor.shutdown(wait=False)
+    add_question_stat("samples_used", drawn)
+    if stats is not None:
+        stats["samples_used"] = drawn
+        stats["num_samples"] = num_samples
     if verbose:
-        print("\nnum of unique results", len(results))
-    if results:
-        majority_ans = max(results, key=results.get)
-        return majority_ans
-    return ""
+        print("\nnum of unique results", len(votes.counts))
+        print("samples used", drawn, "of", num_samples)
+    return votes.majority()
 
-def extract_final_answer(ans: str, isMath: bool = False) -> str:
-    if not ans:
-        return ""
-    ans = ans.strip()
-    match = re.search(r'(?:final\s+answer\s*:?\s*)(.*)', ans, re.IGNORECASE | re.DOTALL)
-    if match:
-        answer = match.group(1).strip()
-        answer = answer.strip('"\'')
-        if answer: 
-            return answer
-    mc_patterns = [ #multiple choice
-        r'(?:answer is|correct answer is|therefore|thus|option|answer choice)\s*:?\s*([A-E])\b',
-        r'\b([A-E])\s+is\s+(?:the\s+)?correct',
-        r'(?:choose|select)\s+(?:option\s+)?([A-E])\b'
-    ]
-    for pattern in mc_patterns:
-        match = re.search(pattern, ans, re.IGNORECASE)
-        if match:
-            return match.group(1).upper()
-    match = re.search(r'\b([A-E])\s*[.)]?\s*$', ans, re.IGNORECASE) #answer ends with a letter
-    if match:
-        return match.group(1).upper()
-    if re.search(r'\d', ans): #worst case extract last number
-        numbers = re.findall(r'-?\d+\.?\d*', ans)
-        if numbers:
-            if isMath: #assuming its a math problem
-                return numbers[-1]
-    return ans
+EXTRACT_ANSWER_SYSTEM_PROMPT = (
+    "Extract the complete final answer from this solution. "
+    "For multiple choice questions, return ONLY the letter (A, B, C, D, or E). "
+    "For numerical answers, return just the number. "
+    "For plans or lists, extract all the steps. "
+    "For reasoning questions, extract the conclusion. "
+    "Reply with only the final answer itself—no explanations, no commentary.\n"
+    "If you cannot determine a clear final answer, return the last meaningful statement.\n"
+    "--- Examples ---\n"
+    "INPUT 1: The total cost is $25, and the tax is $2.50. Final Answer: 27.50\n"
+    "OUTPUT 1: 27.50\n"
+    "INPUT 2: The required steps are: 1. Collect data. 2. Analyze. 3. Finalize. Final Answer: 1. Collect data. 2. Analyze. 3. Finalize\n"
+    "OUTPUT 2: 1. Collect data. 2. Analyze. 3. Finalize"
+)
 
-def chain_of_thought(prompt: str, temp: float = 0.0, isMath: bool = False) -> str:
+def extract_answer(reasoning_resp: str, isMath: bool = False) -> str: #local extraction, model call as fallback
+    final_ans = extract_final_answer(reasoning_resp, isMath=isMath)
+    if reasoning_resp and (len(final_ans) > 500 or final_ans == reasoning_resp.strip()): #i.e. extraction didnt work
+        if current_budget().exhausted(): #no fallback call possible, the raw reasoning is not an answer
+            return ""
+        answer = call_model_chat_completions(prompt=reasoning_resp, system=EXTRACT_ANSWER_SYSTEM_PROMPT, max_tokens=512, temperature=0.0, step="extract")["text"]
+        if answer and answer.strip():
+            return answer.strip()
+    return final_ans if final_ans else reasoning_resp.strip() if reasoning_resp is not None else "" #absolute worst case fallback
+
+def _cot_system_prompt(isMath: bool) -> str:
     cot_instruction = (
         "Think through this problem step by step and solve it completely. "
         "You must provide a complete solution, not just validate or critique. "
@@ -143,67 +217,85 @@ def chain_of_thought(prompt: str, temp: float = 0.0, isMath: bool = False) -> st
         )
     cot_instruction += "At the very end, write 'Final Answer:' followed by your complete answer."
     cot_system_prompt = "You are a problem-solving assistant. Always provide complete solutions."
-    reasoning_resp = call_model_chat_completions(prompt=prompt, system=cot_system_prompt+" "+cot_instruction, max_tokens=4096, temperature=temp)["text"]
+    return cot_system_prompt + " " + cot_instruction
+
+def chain_of_thought(prompt: str, temp: float = 0.0, isMath: bool = False, cancel: threading.Event = None) -> str:
+    resp = call_model_chat_completions(prompt=prompt, system=_cot_system_prompt(isMath), max_tokens=4096, temperature=temp, step="cot",
+                                       stop_when=final_answer_complete, cancel=cancel) #stream, stop once the final answer is written
+    if resp.get("stopped_reason") == "deadline": #half-written reasoning, "" so self_consistency skips the sample
+        return ""
+    if cancel is not None and cancel.is_set(): #vote already decided, skip the extraction call
+        return ""
+    reasoning_resp = resp["text"]
     # if reasoning_resp == "":
     #     print("EMPTY REASONING")
-    final_ans = extract_final_answer(reasoning_resp, isMath=isMath)
-    if len(final_ans) > 500 or final_ans == reasoning_resp: #i.e. extraction didnt work
-        extract_answer_system_prompt = (
-            "Extract the complete final answer from this solution. "
-            "For multiple choice questions, return ONLY the letter (A, B, C, D, or E). "
-            "For numerical answers, return just the number. "
-            "For plans or lists, extract all the steps. "
-            "For reasoning questions, extract the conclusion. "
-            "Reply with only the final answer itself—no explanations, no commentary.\n"
-            "If you cannot determine a clear final answer, return the last meaningful statement.\n"
-            "--- Examples ---\n"
-            "INPUT 1: The total cost is $25, and the tax is $2.50. Final Answer: 27.50\n"
-            "OUTPUT 1: 27.50\n"
-            "INPUT 2: The required steps are: 1. Collect data. 2. Analyze. 3. Finalize. Final Answer: 1. Collect data. 2. Analyze. 3. Finalize\n"
-            "OUTPUT 2: 1. Collect data. 2. Analyze. 3. Finalize"
-        )
-        answer = call_model_chat_completions(prompt=reasoning_resp, system=extract_answer_system_prompt, max_tokens=512, temperature=0.0)["text"]
-        if answer and answer.strip():
-            return answer.strip()
-    return final_ans if final_ans else reasoning_resp.strip() if reasoning_resp is not None else "" #absolute worst case fallback
+    return extract_answer(reasoning_resp, isMath=isMath) #+1 call only if local extraction fails
+
+def chain_of_thought_samples(prompt: str, temp: float, n: int, isMath: bool = False, cancel: threading.Event = None) -> list:
+    """
+    n CoT answers from one request (BATCH_SAMPLES servers); fewer if the server ignores n.
+    All n samples share one temperature, and the request is not streamed, so there is no early stop
+    after the Final Answer and no stop mid-wave once the vote is decided.
+    """
+    resp = call_model_chat_completions(prompt=prompt, system=_cot_system_prompt(isMath), max_tokens=4096, temperature=temp, step="cot", n=n, cancel=cancel)
+    if cancel is not None and cancel.is_set():
+        return []
+    return [extract_answer(text, isMath=isMath) for text in resp.get("texts") or [resp["text"]]]
+
+REFINE_FEEDBACK_REQUEST = (
+    "Act as a critical evaluator of your answer above. Give constructive feedback on how to improve it, focusing on "
+    "accuracy, completeness, clarity, and relevance. Point out any errors, missing information, or areas that need better "
+    "explanation. Be specific about what needs improvement. Do not provide a revised answer, only feedback. "
+    "On the last line, write 'SCORE:' followed by a single number from -1 (very negative, many issues) to 1 "
+    "(very positive, excellent answer) rating how correct and high-quality the answer is, e.g. SCORE: 0.7"
+)
+REFINE_REVISE_REQUEST = (
+    "Generate a REVISED, complete answer to the original prompt that addresses all points of the feedback. "
+    "IMPORTANT: Output ONLY the revised answer. Do not acknowledge the feedback. "
+    "Do NOT start with 'Here is the revised plan'. Just output the content."
+)
+_SCORE = re.compile(r"SCORE\s*[:=]\s*\**\s*(-?\d+(?:\.\d+)?)", re.IGNORECASE)
+
+def _feedback_score(feedback: str) -> float:
+    """Last 'SCORE: x' in the feedback clamped to [-1, 1]; 0.0 (keep refining) if there is none."""
+    matches = _SCORE.findall(feedback)
+    return max(-1.0, min(1.0, float(matches[-1]))) if matches else 0.0
 
-def self_refine(prompt: str, domain: str, temp: float = 0.0, max_iter=3, verbose=False) -> str:
-    initial_ans = call_model_chat_completions(prompt=prompt, max_tokens=4096, temperature=temp)["text"] #1
-    refine_sys_prompt = f"You are a critical evaluator specializing in {domain}. Review the answer provided to the following prompt: {prompt} and give constructive feedback on how to improve it. Focus on accuracy, completeness, clarity, and relevance to {domain}. Point out any errors, missing information, or areas that need better explanation. Be specific about what needs improvement. Do not provide a revised answer, only feedback."
-    new_ans = initial_ans
-    for _ in range (max_iter): #3 calls per iteration = 9 total by default
-        feedback = call_model_chat_completions(prompt=new_ans, system=refine_sys_prompt, max_tokens=2048, temperature=temp)["text"]
-        sentiment_prompt = f"Rate the sentiment of this feedback with respect to how correct and high-quality the answer is, from -1 (very negative, many issues) to 1 (very positive, excellent answer). Return ONLY a single number between -1 and 1 as a decimal (e.g., 0.7, -0.3, 0.9). Do not include any other text or explanation.\n\nFeedback:\n{feedback}"
-        sentiment_result = call_model_chat_completions(prompt=sentiment_prompt, max_tokens=16, temperature=0.0)["text"]
-        sentiment_text = sentiment_result.strip() if sentiment_result is not None else ""
-        match = re.search(r'-?\d+\.?\d*', sentiment_text)
-        if match:
-            sentiment_score = float(match.group())
-            sentiment_score = max(-1.0, min(1.0, sentiment_score))
-        else:
-            sentiment_score = 0.0
+@strategy("self_refine")
+def self_refine(prompt: str, domain: str, temp: float = 0.0, max_iter=3, verbose=False, duplicate_similarity: float = 0.9) -> str:
+    """
+    Runs as one growing conversation (prompt, answer, feedback request, feedback, revise request, revision, ...)
+    under a fixed system prompt, so every call extends the previous call's messages and the server can reuse
+    its cached prefix. The feedback carries its own SCORE, and refinement stops once it is >= 0.7 or a
+    revision is a near-duplicate (token similarity >= duplicate_similarity) of the answer it revised.
+    """
+    refine_sys_prompt = (
+        f"You are a helpful assistant specializing in {domain}. Reply with only the final answer—no explanation. "
+        "When asked to evaluate your answer, give feedback only; when asked to revise it, output only the revised answer."
+    )
+    new_ans = call_model_chat_completions(prompt=prompt, system=refine_sys_prompt, max_tokens=4096, temperature=temp, step="initial")["text"] or "" #1
+    history = [{"role": "user", "content": prompt}, {"role": "assistant", "content": new_ans}]
+    budget = current_budget()
+    for _ in range (max_iter): #2 calls per iteration = 7 total by default
+        if not budget.can_afford(2): #not enough budget left for a full round, keep the current answer
+            break
+        feedback = call_model_chat_completions(prompt=REFINE_FEEDBACK_REQUEST, system=refine_sys_prompt, history=history, max_tokens=2048, temperature=temp, step="feedback")["text"] or ""
+        sentiment_score = _feedback_score(feedback)
         if verbose:
             print("\nsentiment: ", sentiment_score)
         if sentiment_score >= 0.7:
-            break 
-        SYS_PROMPT = (
-            "You are a helpful assistant. You will be given a Previous Answer and Feedback. "
-            "Your job is to generate a REVISED ANSWER that addresses the feedback. "
-            "IMPORTANT: Output ONLY the revised answer. Do not acknowledge the feedback. "
-            "Do NOT start with 'Here is the revised plan'. Just output the content."
-        )
-        formatted_feedback = (
-            f"Please revise the following answer based on the feedback provided:\n\n"
-            f"ORIGINAL PROMPT: {prompt}\n"
-            f"PREVIOUS ANSWER:\n{new_ans}\n\n"
-            f"FEEDBACK:\n{feedback}\n\n"
-            f"Provide a REVISED, complete answer now that addresses all points of the feedback."
-        )
-        prev = new_ans
-        res = call_model_chat_completions(prompt=formatted_feedback, system=SYS_PROMPT, max_tokens=4096, temperature=temp)["text"]
-        new_ans = res.strip() if res is not None else prev
+            break
+        history += [{"role": "user", "content": REFINE_FEEDBACK_REQUEST}, {"role": "assistant", "content": feedback}]
+        res = call_model_chat_completions(prompt=REFINE_REVISE_REQUEST, system=refine_sys_prompt, history=history, max_tokens=4096, temperature=temp, step="revise")["text"]
+        if not res or not res.strip():
+            break
+        prev, new_ans = new_ans, res.strip()
+        if token_similarity(new_ans, prev) >= duplicate_similarity: #revision barely changed anything, further rounds won't either
+            break
+        history += [{"role": "user", "content": REFINE_REVISE_REQUEST}, {"role": "assistant", "content": new_ans}]
     return new_ans
 
+@strategy("assumption_explicit_reasoning")
 def assumption_explicit_reasoning(prompt: str, domain: str, temp: float = 0.0) -> str:
     init_ans = chain_of_thought(prompt, temp) #2
     extraction_sys_prompt = (
@@ -218,7 +310,9 @@ def assumption_explicit_reasoning(prompt: str, domain: str, temp: float = 0.0) -
     "2. No external factors will interfere with the planned schedule.\n"
     "3. The resources required for the tasks are all available immediately."
     )
-    assumptions = call_model_chat_completions(prompt=init_ans, system=extraction_sys_prompt, max_tokens=1024)["text"] #3
+    if not current_budget().can_afford(2): #can't afford assumptions + second pass, keep the CoT answer
+        return init_ans
+    assumptions = call_model_chat_completions(prompt=init_ans, system=extraction_sys_prompt, max_tokens=1024, step="assumptions")["text"] #3
     if not assumptions: #no assumptions found
         assumptions = "No specific assumptions found."
     reasoning_sys_prompt = (
@@ -227,30 +321,14 @@ def assumption_explicit_reasoning(prompt: str, domain: str, temp: float = 0.0) -
         "Do not include any other commentary, and DO NOT list the assumptions separately. "
         f"Assumptions: {assumptions}"
     )
-    reasoning_resp = call_model_chat_completions( #4
+    resp = call_model_chat_completions( #4
         prompt=prompt,                 
         system=reasoning_sys_prompt, 
         max_tokens=4096, 
-        temperature=temp
-    )["text"]
-    isMath = (domain == "Math")
-    final_answer = extract_final_answer(reasoning_resp, isMath=isMath)
-    if len(final_answer) > 500 or final_answer == reasoning_resp: #i.e. extraction didnt work
-        extract_answer_system_prompt = ( #5
-            "Extract the complete final answer from this solution. "
-            "For multiple choice questions, return ONLY the letter (A, B, C, D, or E). "
-            "For numerical answers, return just the number. "
-            "For plans or lists, extract all the steps. "
-            "For reasoning questions, extract the conclusion. "
-            "Reply with only the final answer itself—no explanations, no commentary.\n"
-            "If you cannot determine a clear final answer, return the last meaningful statement.\n"
-            "--- Examples ---\n"
-            "INPUT 1: The total cost is $25, and the tax is $2.50. Final Answer: 27.50\n"
-            "OUTPUT 1: 27.50\n"
-            "INPUT 2: The required steps are: 1. Collect data. 2. Analyze. 3. Finalize. Final Answer: 1. Collect data. 2. Analyze. 3. Finalize\n"
-            "OUTPUT 2: 1. Collect data. 2. Analyze. 3. Finalize"
-        )
-        answer = call_model_chat_completions(prompt=reasoning_resp, system=extract_answer_system_prompt, max_tokens=512, temperature=0.0)["text"]
-        if answer and answer.strip():
-            return answer.strip()
-    return final_answer if final_answer else reasoning_resp.strip() if reasoning_resp is not None else ""
+        temperature=temp,
+        step="cot",
+        stop_when=final_answer_complete #stream, stop once the final answer is written
+    )
+    if not resp["ok"] or resp.get("stopped_reason") == "deadline": #no usable second pass, keep the CoT answer
+        return init_ans
+    return extract_answer(resp["text"], isMath=(domain == "Math")) or init_ans #5
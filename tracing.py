@@ -0,0 +1,160 @@
+"""
+tracing.py
+
+Per-call latency and token instrumentation. Every call_model_chat_completions call is recorded with
+the question id, strategy and step it belongs to, wall time, time spent queued behind the global
+in-flight cap, time to first token (streamed calls), prompt/completion tokens, status and retries.
+Records can be exported as JSONL or CSV together with per-(strategy, step) p50/p95/p99 summaries.
+The text of every successful "cot" call is kept as well, so bench_extract.py can replay real reasoning traces.
+
+Question id and strategy are carried in contextvars; work handed to another thread should be
+submitted through submit_in_context so it keeps the caller's tags.
+"""
+import contextvars, csv, functools, json, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+
+FIELDS = ("question_id", "strategy", "step", "model", "wall_ms", "queue_ms", "ttft_ms", "prompt_tokens",
+          "completion_tokens", "status", "ok", "retries", "cached", "stopped_early", "stopped_reason")
+SUMMARY_METRICS = ("wall_ms", "queue_ms", "ttft_ms", "prompt_tokens", "completion_tokens")
+
+_question_id = contextvars.ContextVar("question_id", default=None)
+_strategy = contextvars.ContextVar("strategy", default="agent")
+_question_stats = contextvars.ContextVar("question_stats", default=None)
+_records = []
+_question_records = []
+_cot_traces = []
+_records_lock = threading.Lock()
+
+@contextmanager
+def question(question_id):
+    """Tags model calls with question_id and records the question's wall time and add_question_stat counters."""
+    token = _question_id.set(question_id)
+    stats = {}
+    stats_token = _question_stats.set(stats)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _question_id.reset(token)
+        _question_stats.reset(stats_token)
+        wall_ms = round((time.perf_counter() - start) * 1000, 3)
+        with _records_lock:
+            _question_records.append({"question_id": question_id, "wall_ms": wall_ms, **stats})
+
+def add_question_stat(name: str, amount: int = 1) -> None:
+    """Adds amount to a per-question counter (e.g. samples_used); no-op outside question()."""
+    stats = _question_stats.get()
+    if stats is not None:
+        with _records_lock:
+            stats[name] = stats.get(name, 0) + amount
+
+def strategy(name: str):
+    """Decorator tagging every model call made inside the function with the strategy name."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = _strategy.set(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _strategy.reset(token)
+        return wrapper
+    return decorator
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """executor.submit that runs fn with the caller's question/strategy tags."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def record_call(step: str, model: str, wall_ms: float, queue_ms: float, response: dict, retries: int = 0) -> None:
+    usage = (response.get("raw") or {}).get("usage") or {}
+    record = {
+        "question_id": _question_id.get(),
+        "strategy": _strategy.get(),
+        "step": step or "other",
+        "model": model,
+        "wall_ms": round(wall_ms, 3),
+        "queue_ms": round(queue_ms, 3),
+        "ttft_ms": round(response["ttft_ms"], 3) if response.get("ttft_ms") is not None else None,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "status": response.get("status"),
+        "ok": response.get("ok"),
+        "retries": retries,
+        "cached": bool(response.get("cached")),
+        "stopped_early": bool(response.get("stopped_early")),
+        "stopped_reason": response.get("stopped_reason"),
+    }
+    texts = (response.get("texts") or [response.get("text")]) if step == "cot" and response.get("ok") else []
+    with _records_lock:
+        _records.append(record)
+        _cot_traces.extend({"question_id": record["question_id"], "strategy": record["strategy"],
+                            "stopped_reason": record["stopped_reason"], "text": text} for text in texts if text)
+
+def get_records() -> list:
+    with _records_lock:
+        return list(_records)
+
+def get_question_records() -> list:
+    with _records_lock:
+        return list(_question_records)
+
+def get_cot_traces() -> list:
+    with _records_lock:
+        return list(_cot_traces)
+
+def reset_records() -> None:
+    with _records_lock:
+        _records.clear()
+        _question_records.clear()
+        _cot_traces.clear()
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def summarize(records: list = None) -> list:
+    """One row per (strategy, step) plus an overall row, with call counts and p50/p95/p99 of each metric."""
+    records = get_records() if records is None else records
+    groups = {("all", "all"): records}
+    for record in records:
+        groups.setdefault((record["strategy"], record["step"]), []).append(record)
+    rows = []
+    for (strategy_name, step), group in sorted(groups.items()):
+        row = {"strategy": strategy_name, "step": step, "calls": len(group),
+               "errors": sum(not r["ok"] for r in group), "cached": sum(r["cached"] for r in group),
+               "retries": sum(r["retries"] for r in group),
+               "stopped_early": sum(r["stopped_early"] for r in group)}
+        for metric in SUMMARY_METRICS:
+            values = [r[metric] for r in group if r[metric] is not None]
+            row[f"{metric}_total"] = round(sum(values), 3)
+            for pct in (50, 95, 99):
+                row[f"{metric}_p{pct}"] = round(percentile(values, pct), 3)
+        rows.append(row)
+    return rows
+
+def _write(rows: list, path: Path, fields) -> None:
+    path = Path(path)
+    with path.open("w", encoding="utf-8", newline="") as fp:
+        if path.suffix == ".csv":
+            writer = csv.DictWriter(fp, fieldnames=list(fields))
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                fp.write(json.dumps(row) + "\n")
+
+def export_records(path) -> None:
+    """Writes every call record to path (.csv for CSV, anything else for JSONL)."""
+    _write(get_records(), path, FIELDS)
+
+def export_cot_traces(path) -> None:
+    """Writes the reasoning text of every "cot" call to path as JSONL, the corpus for bench_extract.py."""
+    _write(get_cot_traces(), path, ("question_id", "strategy", "stopped_reason", "text"))
+
+def export_summary(path) -> list:
+    rows = summarize()
+    _write(rows, path, rows[0].keys() if rows else ("strategy", "step", "calls"))
+    return rows
@@ -0,0 +1,95 @@
+"""
+voting.py
+
+Answer normalization and clustering for self_consistency. Answers that mean the same thing
+("42", "42.0", "$42", "The answer is 42", "84/2") are folded onto one canonical key so they vote
+together; free-text answers can optionally be merged by token-set (Jaccard) similarity. Only
+currency and percent words are dropped from numbers; any other unit stays in the key, so "3 apples"
+and "3 oranges" (or "2 pm" and "2 am") stay apart.
+"""
+import re
+from fractions import Fraction
+
+_PREFIX = re.compile(
+    r"^(?:(?:so|thus|therefore|hence),?\s+)?(?:the\s+)?(?:final\s+)?(?:correct\s+)?(?:answer|result|solution)"
+    r"(?:\s+is)?\s*[:=\-]?\s*", re.IGNORECASE)
+_ASSIGNMENT = re.compile(r"^[a-z]\s*=\s*", re.IGNORECASE) #"x = 5"
+_MC = re.compile(r"^(?:option\s+|choice\s+)?\(?([A-E])\)?(?:[.):]\s*.*|\s*)$", re.IGNORECASE | re.DOTALL)
+_NUMBER = re.compile(r"^([-+]?)\$?\s*(\d+(?:,\d{3})*(?:\.\d+)?|\.\d+)(?:\s*/\s*(\d+(?:\.\d+)?))?\s*(%|[a-z]+(?:\s+[a-z]+)?)?$",
+                     re.IGNORECASE)
+_PUNCT = re.compile(r"[^\w\s]")
+DROPPED_UNITS = {"%", "percent", "dollar", "dollars", "usd", "us dollars"} #same quantity with or without them
+_WORDS = re.compile(r"\w+")
+
+
+def _number_key(text: str):
+    match = _NUMBER.match(text)
+    if not match:
+        return None
+    sign, whole, denominator, unit = match.groups()
+    try:
+        value = Fraction(whole.replace(",", ""))
+        if denominator:
+            value /= Fraction(denominator)
+    except (ValueError, ZeroDivisionError):
+        return None
+    value = -value if sign == "-" else value
+    key = f"num:{value.numerator}" if value.denominator == 1 else f"num:{value.numerator}/{value.denominator}"
+    unit = " ".join((unit or "").lower().split())
+    return key if not unit or unit in DROPPED_UNITS else f"{key} {unit}"
+
+
+def canonicalize(answer: str) -> str:
+    """Canonical voting key for an answer: num:<fraction>, mc:<letter> or txt:<normalized text>."""
+    text = (answer or "").replace("\u2212", "-").strip().strip("\"'`*").strip() #U+2212 minus sign
+    text = _PREFIX.sub("", text).strip()
+    text = re.sub(r"\\boxed\{(.*)\}", r"\1", text).strip()
+    text = text.rstrip(".").strip()
+    mc = _MC.match(text)
+    if mc:
+        return f"mc:{mc.group(1).lower()}"
+    number = _number_key(_ASSIGNMENT.sub("", text))
+    if number:
+        return number
+    return "txt:" + " ".join(_PUNCT.sub(" ", text.lower()).split())
+
+
+def token_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the two answers' lowercase word sets."""
+    tokens_a, tokens_b = set(_WORDS.findall(a.lower())), set(_WORDS.findall(b.lower()))
+    if not tokens_a and not tokens_b:
+        return 1.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+class AnswerClusters:
+    """
+    Vote counter over canonical answer clusters. counts maps cluster key -> votes; majority()
+    returns the most common original string inside the winning cluster.
+    """
+    def __init__(self, similarity: float = None):
+        self.similarity = similarity #token-set threshold for merging free text, None = exact keys only
+        self.counts = {}
+        self._members = {}
+
+    def _cluster_for(self, key: str) -> str:
+        if key in self.counts or self.similarity is None or not key.startswith("txt:"):
+            return key
+        for other in self.counts:
+            if other.startswith("txt:") and token_similarity(key[4:], other[4:]) >= self.similarity:
+                return other
+        return key
+
+    def add(self, answer: str) -> str:
+        key = self._cluster_for(canonicalize(answer))
+        self.counts[key] = self.counts.get(key, 0) + 1
+        members = self._members.setdefault(key, {})
+        members[answer] = members.get(answer, 0) + 1
+        return key
+
+    def majority(self) -> str:
+        if not self.counts:
+            return ""
+        key = max(self.counts, key=self.counts.get)
+        members = self._members[key]
+        return max(members, key=members.get)